@@ -5,7 +5,12 @@
 
 
 import io
+import os
+import hashlib
+import itertools
+import concurrent.futures
 import kneed
+import threadpoolctl
 import argparse
 import pyfiglet
 import termcolor
@@ -18,34 +23,63 @@ import sklearn.decomposition
 import matplotlib.pyplot as plt
 import urllib3
 import requests
+import service
+import grid_dbscan
 
 from utilities import *
 
 # This function returns takes as input a log_file and returns a dataframe
-def get_data(log_file, log_type, log_size_limit, FEATURES,encoding_type):
-    if log_type == 'os_processes':
-        data = parse_process_file(log_file)
-        data = pd.DataFrame.from_records(data)
-        data = data.drop_duplicates(subset=['PID'], keep='last')
-        data = data.set_index('PID')
+def get_data(log_file, log_type, log_size_limit, FEATURES,encoding_type,process_aggregates=False,live_processes=False,client_level=None):
+    if client_level is not None:
+        data = get_client_data(log_file, log_type, log_size_limit, FEATURES, client_level)
+    elif log_type == 'os_processes':
+        if live_processes:
+            data = collect_process_table()
+        else:
+            data = parse_process_file(log_file)
+        if process_aggregates:
+            # Keep the last snapshot values and add the per PID aggregates over all the snapshots
+            data = aggregate_process_snapshots(data)
+        else:
+            data = data.drop_duplicates(subset=['PID'], keep='last')
+            data = data.set_index('PID')
         numerical_cols = list(data._get_numeric_data().columns)
         data = data[numerical_cols]
-        data = data.drop(['PGRP', 'PPID', 'UID'], axis=1)
+        data = data.drop(['PGRP', 'PPID', 'UID', 'SNAPSHOT', 'SNAPSHOTS'], axis=1, errors='ignore')
     else:
         try:
             encoded_logs = encode_log_file(log_file, log_type,encoding_type)
         except:
             logging.info('Something went wrong encoding data.')
             sys.exit(1)
-        try:
-            _,data_str = construct_enconded_data_file(encoded_logs, False)
-        except:
-            logging.info('Something went wrong constructing data')
-            sys.exit(1)
-        # Get the raw log lines
-        csvStringIO = io.StringIO(data_str)
-        data = pd.read_csv(csvStringIO, sep=',').head(log_size_limit)
-        data = data[FEATURES]
+        data = get_encoded_data(encoded_logs, log_size_limit, FEATURES)
+    return data
+
+
+# This function returns the dataframe of client sessions (the contributing log lines are in the log_lines column)
+def get_client_data(log_file, log_type, log_size_limit, FEATURES, client_level):
+    try:
+        with open(log_file, 'r') as log_file_content:
+            log_file_content = list(itertools.islice(log_file_content, log_size_limit))
+    except:
+        logging.info('Something went wrong reading the input file.')
+        sys.exit(1)
+    parsed_logs = parse_log_lines(log_file_content, log_type)
+    sessions = get_client_sessions(parsed_logs, client_level == 'ip_user_agent')
+    return sessions[FEATURES + ['log_lines']]
+
+
+# This function returns the dataframe of encoded log lines
+def get_encoded_data(encoded_logs, log_size_limit, FEATURES):
+    try:
+        _,data_str = construct_enconded_data_file(encoded_logs, False)
+    except:
+        logging.info('Something went wrong constructing data')
+        sys.exit(1)
+    # Get the raw log lines
+    csvStringIO = io.StringIO(data_str)
+    data = pd.read_csv(csvStringIO, sep=',').head(log_size_limit)
+    data = data[FEATURES]
     return data
 
 
@@ -80,7 +114,8 @@ def find_elements_by_cluster(labels):
 
 
 # This function return a list a findings
-def catch(labels, data, label, log_type):
+# The details of the processes (os_processes) are given by get_findings, which collects them for all the labels at once
+def catch(labels, data, label, log_type, processes_details=None):
     log_line_number = 0
     if label == -1:
         severity = 'high'
@@ -96,11 +131,14 @@ def catch(labels, data, label, log_type):
                     'log_line':data['log_line'][log_line_number],
                     'severity':severity
                 }
+                # Client findings link back to their contributing log lines
+                if 'log_lines' in data.columns:
+                    finding['log_lines'] = data['log_lines'][log_line_number]
             else:
                 pid = int(data.iloc[[log_line_number]].index.values[0])
                 finding_line = data.iloc[[log_line_number]].values[0]
                 column_names = data.columns.to_list()
-                process_details = get_process_details(pid)
+                process_details = processes_details[pid]
                 finding = {
                     'pid': pid,
                     'log_line':list(zip(column_names, finding_line)),
@@ -115,15 +153,24 @@ def catch(labels, data, label, log_type):
 # This function prints the finding to the terminal
 def print_findings(findings, log_type):
     for finding in findings:
-        if not log_type == 'os_processes':
+        if 'window_start' in finding:
+            logging.info('\n\t/!\ Webhawk {} - Possible anomalous behaviour detected at line:{} (window {} - {})'.format(finding['severity'], finding['log_line_number'], finding['window_start'], finding['window_end']))
+        elif 'log_lines' in finding:
+            logging.info('\n\t/!\ Webhawk {} - Possible anomalous behaviour detected at client:{}'.format(finding['severity'], finding['log_line_number']))
+        elif not log_type == 'os_processes':
             logging.info('\n\t/!\ Webhawk {} - Possible anomalous behaviour detected at line:{}'.format(finding['severity'], finding['log_line_number']))
         else:
             logging.info('\n\t/!\ Webhawk {} - Possible anomalous behaviour detected at line:{}'.format(finding['severity'], finding['pid']))
         logging.info('\t{}'.format(finding['log_line']))
+        if 'log_lines' in finding:
+            for log_line in finding['log_lines'][:MAX_PRINTED_CLIENT_LOG_LINES]:
+                logging.info('\t\t{}'.format(log_line.rstrip('\n')))
+            if len(finding['log_lines']) > MAX_PRINTED_CLIENT_LOG_LINES:
+                logging.info('\t\t... {} more log lines'.format(len(finding['log_lines'])-MAX_PRINTED_CLIENT_LOG_LINES))
 
 
 # This function plots the finding
-def plot_findings(dataframe, labels,save_at):
+def plot_findings(dataframe, labels,save_at,sample_weight=None):
     # Plot finddings
     unique_labels = set(labels)
     colors = [plt.cm.Spectral(each) for each in np.linspace(1, 0, len(unique_labels))]
@@ -136,7 +183,7 @@ def plot_findings(dataframe, labels,save_at):
             marker = 'x'
             markersize = 10
             markeredgecolor = 'r'
-            outliers_count+=1
+            outliers_count+=1 if sample_weight is None else sample_weight[index]
         # Plot other (minority cluster points)
         else:
             marker = 'o'
@@ -156,9 +203,9 @@ def plot_findings(dataframe, labels,save_at):
 
 
 # This function find the maximum curvature point among the sorted neighbors distance plot
-def find_max_curvature_point(dataframe, plot):
+def find_max_curvature_point(dataframe, plot, algorithm='auto', n_jobs=None):
     # Finding the nearest neighbors
-    neighbors = sklearn.neighbors.NearestNeighbors(n_neighbors=2)
+    neighbors = sklearn.neighbors.NearestNeighbors(n_neighbors=2, algorithm=algorithm, n_jobs=n_jobs)
     nbrs = neighbors.fit(dataframe)
     distances, indices = nbrs.kneighbors(dataframe)
     # Sorting the nearest neighbors distance
@@ -183,17 +230,241 @@ def find_max_curvature_point(dataframe, plot):
     return kl.knee
 
 
+# This function returns a stratified sample of the data and the weight of each sampled point
+# Strata are quantile bins of the distance to the median point. The outer shell (most isolated points, which shape the
+# tail of the neighbors distance curve) is always fully kept, the other strata are sampled proportionally.
+def get_stratified_sample(dataframe, sample_size, strata=10, outer_shell=0.01, random_state=0):
+    values = np.asarray(dataframe, dtype=float)
+    if sample_size is None or sample_size >= len(values):
+        return np.arange(len(values)), np.ones(len(values))
+    rng = np.random.default_rng(random_state)
+    radius = np.linalg.norm(values - np.median(values, axis=0), axis=1)
+    edges = np.quantile(radius, np.linspace(0, 1-outer_shell, strata+1)[1:])
+    strata_ids = np.searchsorted(edges, radius, side='right')
+    sample_indices = []
+    sample_weights = []
+    for stratum in np.unique(strata_ids):
+        members = np.flatnonzero(strata_ids == stratum)
+        if stratum == strata:
+            stratum_size = len(members)
+        else:
+            stratum_size = min(len(members), max(1, int(round(sample_size*len(members)/len(values)))))
+        sample_indices.append(rng.choice(members, size=stratum_size, replace=False))
+        sample_weights.append(np.full(stratum_size, len(members)/stratum_size))
+    return np.concatenate(sample_indices), np.concatenate(sample_weights)
+
+
+# This function returns the points alone in their cell of a grid whose cells have a diagonal equal to radius
+# Only these points can be farther than radius from their nearest neighbor
+def get_isolated_points(values, radius):
+    side = radius/np.sqrt(values.shape[1])*(1-1e-9)
+    cells = np.floor((values - values.min(axis=0))/side).astype(np.int64)
+    shape = cells.max(axis=0) + 1
+    if np.prod(shape.astype(float)) < 2**62:
+        _, inverse_indices, counts = np.unique(np.ravel_multi_index(cells.T, shape), return_inverse=True, return_counts=True)
+    else:
+        _, inverse_indices, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    return np.flatnonzero(counts[inverse_indices.reshape(-1)] == 1)
+
+
+# This function rounds weights to integers keeping their total (largest remainders first)
+def get_integer_weights(weights, total):
+    integer_weights = np.floor(weights).astype(np.int64)
+    remainder = int(round(total)) - integer_weights.sum()
+    if remainder > 0:
+        integer_weights[np.argsort(integer_weights - weights)[:remainder]] += 1
+    return integer_weights
+
+
+# This function returns a fingerprint of a feature matrix (used as Epsilon cache key)
+def get_data_fingerprint(dataframe):
+    values = np.ascontiguousarray(np.asarray(dataframe, dtype=float))
+    fingerprint = hashlib.sha1(values.tobytes())
+    fingerprint.update(str(values.shape).encode())
+    return fingerprint.hexdigest()
+
+
+# Epsilon values already estimated, by feature matrix fingerprint and estimation parameters
+# The cache lives in memory for the current run only: it lets the detection reuse the estimation of --eps_report
+EPS_CACHE = {}
+
+# Fraction of the sampled distances above which all the points are queried
+EPS_TAIL = 0.01
+
+# Relative error between the sampled and the exact Epsilon above which --eps_report flags the sampled estimation
+EPS_REPORT_TOLERANCE = 0.05
+
+
+# This function approximates Epsilon, the max curvature point of the sorted neighbors distance plot found by
+# find_max_curvature_point. The tree is built on all the points but only a stratified sample of them is queried.
+# Every point that can be farther from its nearest neighbor than the top EPS_TAIL sampled distances is queried too,
+# and the sampled points stand for the rest of the curve. With curve_points, the knee is located on evenly spaced
+# ranks of the curve. The knee locator depends on the whole curve, so the estimation can differ from the exact
+# Epsilon: --eps_report measures the gap on a given log
+def estimate_max_curvature_point(dataframe, plot, sample_size=None, curve_points=None, algorithm='auto', n_jobs=None, refresh_cache=False):
+    values = np.asarray(dataframe, dtype=float)
+    cache_key = (get_data_fingerprint(values), sample_size, curve_points)
+    if not refresh_cache and cache_key in EPS_CACHE:
+        logging.info('{}Using the cached Epsilon of this data'.format(4*' '))
+        return EPS_CACHE[cache_key]
+    # Finding the nearest neighbors of the sampled points only
+    neighbors = sklearn.neighbors.NearestNeighbors(n_neighbors=2, algorithm=algorithm, n_jobs=n_jobs)
+    nbrs = neighbors.fit(values)
+    sample_indices, sample_weights = get_stratified_sample(values, sample_size)
+    distances, indices = nbrs.kneighbors(values[sample_indices])
+    distances, indices, weights = distances[:,1], indices[:,1], sample_weights
+    tail_distances = np.empty(0)
+    tail_indices = np.empty(0, dtype=indices.dtype)
+    if len(sample_indices) < len(values) and (distances > 0).any():
+        # Querying all the points farther than radius from their nearest neighbor
+        sorted_idx = distances.argsort()
+        cumulative_weights = np.cumsum(weights[sorted_idx])
+        radius = distances[sorted_idx][np.searchsorted(cumulative_weights, (1-EPS_TAIL)*cumulative_weights[-1])]
+        radius = max(radius, distances[distances > 0].min())
+        isolated = get_isolated_points(values, radius)
+        isolated = np.setdiff1d(isolated, sample_indices)
+        if len(isolated) > 0:
+            isolated_distances, isolated_indices = nbrs.kneighbors(values[isolated])
+            tail = isolated_distances[:,1] > radius
+            tail_distances = isolated_distances[tail,1]
+            tail_indices = isolated_indices[tail,1]
+        tail = distances > radius
+        tail_distances = np.concatenate([distances[tail], tail_distances])
+        tail_indices = np.concatenate([indices[tail], tail_indices])
+        distances, indices, weights = distances[~tail], indices[~tail], weights[~tail]
+        weights = weights*(len(values)-len(tail_distances))/weights.sum()
+    # Expanding the sampled points to the curve of all the points
+    integer_weights = get_integer_weights(weights, len(values)-len(tail_distances))
+    distances = np.concatenate([np.repeat(distances, integer_weights), tail_distances])
+    indices = np.concatenate([np.repeat(indices, integer_weights), tail_indices])
+    sorted_idx = distances.argsort(kind='stable')
+    distances = distances[sorted_idx]
+    indices = indices[sorted_idx]
+    if curve_points is not None and curve_points < len(distances):
+        # Keeping evenly spaced ranks over the whole curve, including its first and last points
+        kept = np.unique(np.linspace(0, len(distances)-1, max(curve_points, 2)).round().astype(int))
+        distances = distances[kept]
+        indices = indices[kept]
+    # Finding the maximum curvature point
+    if distances[-1] == distances[0]:
+        eps = None
+    else:
+        eps = kneed.KneeLocator(distances, indices, curve="convex", S=10.0).knee
+        eps = None if eps is None else float(eps)
+    # Make plot if required
+    if plot and eps is not None:
+        plt.title('Sorted distance to nearest neighbors and max curvature')
+        plt.plot(distances)
+        plt.axhline(
+            eps,
+            0,
+            1,
+            label="max curve",
+            color='black',
+            linestyle='--'
+            )
+        plt.show()
+    EPS_CACHE[cache_key] = eps
+    return eps
+
+
+# This function compares the sampled Epsilon estimation to the exact one (accuracy vs speed)
+# A sampled estimation farther than EPS_REPORT_TOLERANCE from the exact Epsilon is flagged
+def report_eps_estimation(dataframe, sample_size, curve_points, algorithm='auto', n_jobs=None):
+    report = []
+    for method, method_sample_size, method_curve_points in [
+        ('exact', None, None),
+        ('sampled', sample_size, curve_points)]:
+        start_time = time.perf_counter()
+        if method == 'exact':
+            eps = find_max_curvature_point(dataframe, False, algorithm, n_jobs)
+            eps = None if eps is None else float(eps)
+        else:
+            eps = estimate_max_curvature_point(dataframe, False, method_sample_size, method_curve_points, algorithm, n_jobs, refresh_cache=True)
+        report.append({
+            'method': method,
+            'sample_size': method_sample_size,
+            'curve_points': method_curve_points,
+            'eps': eps,
+            'seconds': time.perf_counter()-start_time,
+        })
+    exact_eps = report[0]['eps']
+    for line in report:
+        if exact_eps and line['eps'] is not None:
+            line['relative_error'] = abs(line['eps']-exact_eps)/exact_eps
+            line['flagged'] = line['relative_error'] > EPS_REPORT_TOLERANCE
+        else:
+            line['relative_error'] = None
+            line['flagged'] = line['eps'] != exact_eps
+        logging.info('{}{}'.format(4*' ', line))
+        if line['flagged']:
+            logging.warning('{}The sampled Epsilon {} differs from the exact Epsilon {} by more than {:.0%}: increase --eps_sample_size and --eps_curve_points or use the exact estimation'.format(4*' ', line['eps'], exact_eps, EPS_REPORT_TOLERANCE))
+    return report
+
+
+# This function collapses identical rows into unique rows, kept in the order of their first occurrence
+# It returns the unique rows, the index of the unique row of each original row and the number of rows by unique row
+def deduplicate_data(dataframe):
+    values = np.asarray(dataframe, dtype=float)
+    _, first_indices, inverse_indices, counts = np.unique(values, axis=0, return_index=True, return_inverse=True, return_counts=True)
+    order = np.argsort(first_indices)
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+    return values[first_indices[order]], ranks[inverse_indices.reshape(-1)], counts[order]
+
+
+# This function returns the silhouette coefficient of weighted points
+# It is equal to the silhouette coefficient of the data where each point is repeated as many times as its weight
+def get_silhouette_score(dataframe, labels, sample_weight=None, n_jobs=None):
+    if sample_weight is None:
+        return sklearn.metrics.silhouette_score(dataframe, labels, n_jobs=n_jobs)
+    values = np.asarray(dataframe, dtype=float)
+    sample_weight = np.asarray(sample_weight, dtype=float)
+    cluster_labels, cluster_indices = np.unique(labels, return_inverse=True)
+    cluster_weights = np.bincount(cluster_indices, weights=sample_weight)
+    # Weighted one hot encoding of the clusters
+    weighted_clusters = np.zeros((len(values), len(cluster_labels)))
+    weighted_clusters[np.arange(len(values)), cluster_indices] = sample_weight
+    scores = []
+    chunk_start = 0
+    for distances in sklearn.metrics.pairwise_distances_chunked(values, n_jobs=n_jobs):
+        chunk_indices = np.arange(chunk_start, chunk_start+len(distances))
+        chunk_start += len(distances)
+        own_clusters = cluster_indices[chunk_indices]
+        # Sum of the distances to the points of each cluster (identical points are at distance 0)
+        cluster_distances = distances @ weighted_clusters
+        own_cluster_weights = cluster_weights[own_clusters]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intra_distances = cluster_distances[np.arange(len(distances)), own_clusters]/(own_cluster_weights-1)
+            mean_cluster_distances = cluster_distances/cluster_weights
+        mean_cluster_distances[np.arange(len(distances)), own_clusters] = np.inf
+        inter_distances = mean_cluster_distances.min(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chunk_scores = (inter_distances-intra_distances)/np.maximum(intra_distances, inter_distances)
+        # The points of single point clusters have a null silhouette
+        chunk_scores[own_cluster_weights <= 1] = 0
+        scores.append(np.nan_to_num(chunk_scores))
+    return float(np.average(np.concatenate(scores), weights=sample_weight))
+
+
+# This function returns a DBSCAN model of the selected engine (sklearn, or grid for the 2 dimensions PCA space)
+def get_dbscan(engine='sklearn', n_jobs=None, **dbscan_params):
+    if engine == 'grid':
+        return grid_dbscan.GridDBSCAN(**dbscan_params)
+    return sklearn.cluster.DBSCAN(n_jobs=n_jobs, **dbscan_params)
+
+
 # This function optimize Epsilon to get the best BDSCAN silouhette Coefficient
-def optimize_silouhette_coefficient(max_curve, dataframe, lambda_value):
+def optimize_silouhette_coefficient(max_curve, dataframe, lambda_value, sample_weight=None, n_jobs=None, engine='sklearn'):
     current_eps = lambda_value
     best_silouhette = 0
     best_eps_for_silouhette = None
     while current_eps <= 1.5 * max_curve:
-        dbscan = sklearn.cluster.DBSCAN(eps=current_eps)
-        dbscan_model = dbscan.fit(dataframe)
+        dbscan = get_dbscan(engine, n_jobs, eps=current_eps)
+        dbscan_model = dbscan.fit(dataframe, sample_weight=sample_weight)
         labels = dbscan_model.labels_
         if len(set(dbscan_model.labels_)) > 1:
-            current_silouhette = sklearn.metrics.silhouette_score(dataframe, labels)
+            current_silouhette = get_silhouette_score(dataframe, labels, sample_weight, n_jobs)
         if current_silouhette > best_silouhette:
             best_silouhette = current_silouhette
             best_eps_for_silouhette = current_eps
@@ -253,9 +524,303 @@ def find_cves(findings):
     return enriched_findings
 
 
+# This function reduces the data to 2 dimensions using PCA and clusters it using DBSCAN
+# It returns None if a single cluster is found
+def cluster_data(data, args, FEATURES, interactive=True):
+    LAMBDA = float(args['opt_lamda']) if args['opt_lamda'] is not None else 0.01
+    EPS_SAMPLE_SIZE = int(args['eps_sample_size']) if args['eps_sample_size'] is not None else None
+    EPS_CURVE_POINTS = int(args['eps_curve_points']) if args['eps_curve_points'] is not None else None
+    JOBS = args['jobs']
+    EPS_JOBS = int(args['eps_jobs']) if args['eps_jobs'] is not None else JOBS
+    show_plots = interactive and args['show_plots']
+
+    # convert to a dataframe
+    if args['log_type'] != 'os_processes':
+        dataframe = data.to_numpy()[:,list(range(0,len(FEATURES)-1))]
+    else:
+        dataframe = data
+
+    # Standarize data
+    scaler = None
+    if args['standardize_data']:
+        scaler = sklearn.preprocessing.StandardScaler()
+        dataframe = scaler.fit_transform(dataframe)
+
+    # Dimensiality reduction to 2d using PCA
+    pca = sklearn.decomposition.PCA(n_components=2)
+    principal_components_df = pca.fit_transform(dataframe)
+    all_principal_components = principal_components_df
+    sample_weight = None
+    if args['deduplicate']:
+        # All the lines are projected as without deduplication, DBSCAN and the silhouette only process the unique points
+        principal_components_df, inverse_indices, sample_weight = deduplicate_data(principal_components_df)
+        logging.info('\n> {} lines collapsed into {} unique feature vectors'.format(len(inverse_indices), len(principal_components_df)))
+    dataframe = pd.DataFrame(
+        data = principal_components_df,
+        columns = ['pc_1', 'pc_2'])
+    all_dataframe = pd.DataFrame(
+        data = all_principal_components,
+        columns = ['pc_1', 'pc_2'])
+
+    # Display and plot data after applying PCA
+    if interactive:
+        print(dataframe)
+        plot_data([dataframe['pc_1'],dataframe['pc_2']],'Data after dimensiality reduction using PCA')
+
+
+    # Getting or setting epsilon
+    if args['eps_report']:
+        logging.info('\n> Comparing the sampled Epsilon estimation to the exact one')
+        report_eps_estimation(all_dataframe, EPS_SAMPLE_SIZE, EPS_CURVE_POINTS, args['eps_algorithm'], EPS_JOBS)
+
+    if args['eps'] == None:
+        logging.info('\n> No Epsilon input. Finding the max sorted neighbors curvature point and use it as Epsilon')
+        # Epsilon is estimated on all the lines, so the deduplication does not change it
+        if EPS_SAMPLE_SIZE is None and EPS_CURVE_POINTS is None:
+            automatic_max_curve_point = find_max_curvature_point(all_dataframe, show_plots, args['eps_algorithm'], EPS_JOBS)
+        else:
+            automatic_max_curve_point = estimate_max_curvature_point(
+                all_dataframe,
+                show_plots,
+                EPS_SAMPLE_SIZE,
+                EPS_CURVE_POINTS,
+                args['eps_algorithm'],
+                EPS_JOBS)
+        selected_eps = automatic_max_curve_point
+        logging.info('{}{}'.format(4*' ',automatic_max_curve_point))
+        if selected_eps is None or selected_eps <= 0:
+            selected_eps = sklearn.cluster.DBSCAN().eps
+            logging.info('{}No positive max curvature point was found, the DBSCAN default value {} is used'.format(4*' ', selected_eps))
+    else:
+        selected_eps=float(args['eps'])
+
+    if args['opt_silouhette']:
+        logging.info('\n> Optimizing Epsilon to get the best BDSCAN Silhouette Coefficient')
+        best_silouhette, best_eps_for_silouhette = optimize_silouhette_coefficient(selected_eps, dataframe, LAMBDA, sample_weight, JOBS, args['dbscan_engine'])
+        logging.info('{}{}'.format(4*' ', best_eps_for_silouhette))
+        selected_eps = best_eps_for_silouhette
+
+    logging.info('{}The value {} will be used as final DBSCAN Epsilon'.format(4*' ', selected_eps))
+
+    logging.info('\n> Starting detection..')
+    # Use dbscan for clustering and train the model
+
+    if args['eps'] == None and args['min_samples'] == None:
+        dbscan = get_dbscan(args['dbscan_engine'], JOBS, eps=selected_eps)
+    elif args['eps'] == None:
+        dbscan = get_dbscan(args['dbscan_engine'], JOBS, eps=selected_eps, min_samples=int(args['min_samples']))
+    elif args['min_samples'] == None:
+        dbscan = get_dbscan(args['dbscan_engine'], JOBS, eps=selected_eps)
+    else:
+        dbscan = get_dbscan(args['dbscan_engine'], JOBS, eps=selected_eps, min_samples=int(args['min_samples']))
+    dbscan_model = dbscan.fit(dataframe, sample_weight=sample_weight)
+
+    # Check the number of labels (if 1 then try without EPS value)
+    if len(set(dbscan_model.labels_)) == 1:
+        logging.info('{}Only one cluster was found using the value {} as epsilon'.format(4*' ',selected_eps))
+        logging.info('{}Trying without epsilon'.format(4*' '))
+        dbscan = get_dbscan(args['dbscan_engine'], JOBS)
+        dbscan_model = dbscan.fit(dataframe, sample_weight=sample_weight)
+    if len(set(dbscan_model.labels_)) == 1:
+        logging.info('{}Only one cluster was found without an epsilon value.'.format(4*' '))
+        return None
+
+    # Get point labels (expanded back to all the lines if the feature vectors were deduplicated)
+    unique_labels = dbscan_model.labels_
+    labels = unique_labels if sample_weight is None else unique_labels[inverse_indices]
+    return {
+        'dataframe': dataframe,
+        'unique_labels': unique_labels,
+        'labels': labels,
+        'sample_weight': sample_weight,
+        'scaler': scaler,
+        'pca': pca,
+        'dbscan_model': dbscan_model,
+    }
+
+
+# This function returns the high (outliers) and medium (minority clusters) severity findings
+def get_findings(labels, data, log_type, threshold):
+    elements_by_cluster = find_elements_by_cluster(labels)
+
+    # Get top minority clusters
+    minority_clusters = get_minority_clusters(elements_by_cluster,threshold)
+
+    # The details of the processes of all the findings are collected in a single sweep of the process table
+    processes_details = None
+    if log_type == 'os_processes':
+        finding_pids = data.index.values[np.isin(labels, [-1] + list(minority_clusters))]
+        processes_details = get_processes_details(finding_pids)
+
+    # Outliers are considred as high severity findings
+    high_findings = catch(labels,data,-1, log_type, processes_details)
+
+    # Points belonging to minority clusters are considred as medium severity findings
+    medium_findings=[]
+    for label in minority_clusters:
+        if label != -1:
+            medium_findings += catch(labels,data,label, log_type, processes_details)
+    return high_findings, medium_findings, minority_clusters
+
+
+# This function runs the detection on the log lines of a time window (run by the window workers)
+def detect_window(window, args, FEATURES, encoding_type):
+    THRESHOLD = int(args['minority_threshold']) if args['minority_threshold'] else 5
+    window_name = '{} - {}'.format(window['window_start'], window['window_end'])
+    # The thread limits of the main process are not inherited by the worker processes
+    threadpoolctl.threadpool_limits(limits=args['blas_threads'])
+    data = get_encoded_data(encode_log_lines(window['log_lines'], args['log_type'], encoding_type), len(window['log_lines']), FEATURES)
+    # The PCA of the clustering needs at least two log lines
+    if len(data) < 2:
+        logging.info('{}Window {}: {} log lines, skipped (too few log lines to cluster)'.format(4*' ', window_name, len(data)))
+        return [], []
+    clustering = cluster_data(data, args, FEATURES, interactive=False)
+    if clustering is None:
+        logging.info('{}Window {}: {} log lines, skipped (only one cluster was found)'.format(4*' ', window_name, len(data)))
+        return [], []
+    high_findings, medium_findings, _ = get_findings(clustering['labels'], data, args['log_type'], THRESHOLD)
+    # Line numbers of the window are converted to line numbers of the log file
+    for finding in high_findings + medium_findings:
+        finding['log_line_number'] = window['line_numbers'][finding['log_line_number']]
+        finding['window_start'] = str(window['window_start'])
+        finding['window_end'] = str(window['window_end'])
+    logging.info('{}Window {}: {} log lines, {} high and {} medium severity findings'.format(4*' ', window_name, len(data), len(high_findings), len(medium_findings)))
+    return high_findings, medium_findings
+
+
+# This function runs the detection separately on each time window of the log file, using parallel workers
+def detect_by_window(args, FEATURES, encoding_type, log_size_limit):
+    try:
+        with open(args['log_file'], 'r') as log_file_content:
+            log_file_content = list(itertools.islice(log_file_content, log_size_limit))
+    except:
+        logging.info('Something went wrong reading the input file.')
+        sys.exit(1)
+    windows = split_log_lines_by_window(log_file_content, args['log_type'], args['window'])
+    workers = int(args['window_workers']) if args['window_workers'] is not None else os.cpu_count()
+    logging.info('{}{} time windows of {} clustered by {} workers'.format(4*' ', len(windows), args['window'], workers))
+    high_findings = []
+    medium_findings = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        windows_findings = executor.map(
+            detect_window,
+            windows,
+            itertools.repeat(args),
+            itertools.repeat(FEATURES),
+            itertools.repeat(encoding_type))
+        for window_high_findings, window_medium_findings in windows_findings:
+            high_findings += window_high_findings
+            medium_findings += window_medium_findings
+    return windows, high_findings, medium_findings
+
+
+# This function fits the model of the scoring service on a reference http log file
+# The categorical indices and fractions of the reference lines are kept to encode the scored lines
+def fit_scoring_model(args, FEATURES, encoding_type, log_size_limit, threshold):
+    try:
+        with open(args['log_file'], 'r') as log_file_content:
+            log_file_content = list(itertools.islice(log_file_content, log_size_limit))
+    except:
+        logging.info('Something went wrong reading the input file.')
+        sys.exit(1)
+    indices = get_categorical_indices(log_file_content, args['log_type'])
+    categorical_fractions = get_categorical_fractions(log_file_content, args['log_type'])
+    data = get_encoded_data(encode_log_lines(log_file_content, args['log_type'], encoding_type, indices, categorical_fractions), log_size_limit, FEATURES)
+    clustering = cluster_data(data, args, FEATURES, interactive=False)
+    if clustering is None:
+        logging.info('{}The scoring model needs more than one cluster. Exiting.'.format(4*' '))
+        sys.exit(1)
+    dbscan_model = clustering['dbscan_model']
+    minority_clusters = get_minority_clusters(find_elements_by_cluster(clustering['labels']), threshold)
+    return {
+        'log_type': args['log_type'],
+        'encoding_type': encoding_type,
+        'features': FEATURES[:-1],
+        'indices': indices,
+        'categorical_fractions': categorical_fractions,
+        'scaler': clustering['scaler'],
+        'pca': clustering['pca'],
+        'eps': dbscan_model.eps,
+        # New points are assigned to the cluster of their nearest core point
+        'core_neighbors': sklearn.neighbors.NearestNeighbors(n_neighbors=1, n_jobs=args['jobs']).fit(dbscan_model.components_),
+        'core_labels': dbscan_model.labels_[dbscan_model.core_sample_indices_],
+        'minority_clusters': minority_clusters,
+        'info': {
+            'log_file': args['log_file'],
+            'log_type': args['log_type'],
+            'encoding_type': encoding_type,
+            'reference_log_lines': len(data),
+            'eps': float(dbscan_model.eps),
+            'clusters': len(set(clustering['labels'])),
+            'minority_clusters': [int(label) for label in minority_clusters],
+        }
+    }
+
+
+# This function scores a batch of http log lines with the model of the scoring service
+# The lines are projected with the fitted PCA, the lines farther than Epsilon from all the core points are high severity findings
+# and the lines assigned to a minority cluster are medium severity findings
+def score_log_lines(model, log_lines):
+    log_format = re.compile(config['LOG'][model['log_type']])
+    encoded_lines = []
+    line_indices = []
+    unparsed_lines = 0
+    for line_index, log_line in enumerate(log_lines):
+        log_line = log_line.replace(',','#').replace(';','#')
+        if log_format.match(log_line) is None:
+            unparsed_lines += 1
+            continue
+        try:
+            _, log_line_data = encode_log_line(log_line, model['log_type'], model['indices'], model['categorical_fractions'], model['encoding_type'])
+        except (ValueError, IndexError):
+            # A line fitting the log format can still hold values that cannot be encoded (e.g. a non numerical size)
+            unparsed_lines += 1
+            continue
+        if log_line_data is not None:
+            encoded_lines.append(log_line_data)
+            line_indices.append(line_index)
+    findings = []
+    if len(encoded_lines) > 0:
+        dataframe = pd.DataFrame(encoded_lines, columns=model['features']).to_numpy(dtype=float)
+        if model['scaler'] is not None:
+            dataframe = model['scaler'].transform(dataframe)
+        principal_components = model['pca'].transform(dataframe)
+        distances, core_indices = model['core_neighbors'].kneighbors(principal_components)
+        labels = np.where(distances[:,0] <= model['eps'], model['core_labels'][core_indices[:,0]], -1)
+        for line_index, label in zip(line_indices, labels):
+            if label == -1 or label in model['minority_clusters']:
+                findings.append({
+                    'line_index': line_index,
+                    'log_line': log_lines[line_index],
+                    'severity': 'high' if label == -1 else 'medium',
+                    'cluster': int(label),
+                })
+    return {
+        'lines': len(log_lines),
+        'scored_lines': len(line_indices),
+        'unparsed_lines': unparsed_lines,
+        'findings': findings,
+    }
+
+
+# This function finds the CVEs related to the findings and generates the HTML report if requested
+def report_findings(all_findings, args):
+    if args['find_cves'] == True:
+        logging.info('> Finding CVEs started')
+        all_findings = find_cves(all_findings)
+    # Generate a HTML report if requested
+    if args['report']:
+        #find_cves(all_findings)
+        gen_report(
+            all_findings,args['log_file'],
+            args['log_type'],
+            args['window'] is None,
+            )
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-l', '--log_file', help = 'The raw http log file', required = True)
+    parser.add_argument('-l', '--log_file', help = 'The raw http log file', required = False)
     parser.add_argument('-t', '--log_type', help = 'apache or nginx', required = True)
     parser.add_argument('-e', '--eps', help='DBSCAN Epsilon value (Max distance between two points)', required=False)
     parser.add_argument('-s', '--min_samples', help='Minimum number of points with the same cluster. The default value is 2', required=False)
@@ -269,18 +834,56 @@ def main():
     parser.add_argument('-b', '--debug', help = 'Activate debug logging', action='store_true')
     parser.add_argument('-c', '--label_encoding', help = 'Use label encoding instead of frequeny encoding to encode categorical features', action='store_true')
     parser.add_argument('-v', '--find_cves', help = 'Find the CVE(s) that are related to the attack traces', action='store_true')
+    parser.add_argument('--eps_sample_size', help = 'Number of points (stratified sample) used to estimate Epsilon (approximate)', required = False)
+    parser.add_argument('--eps_curve_points', help = 'Number of evenly spaced points of the sorted neighbors distance curve used to locate the max curvature point (approximate)', required = False)
+    parser.add_argument('--eps_algorithm', help = 'Nearest neighbors algorithm used to estimate Epsilon', choices = ['auto', 'kd_tree', 'ball_tree', 'brute'], default = 'auto')
+    parser.add_argument('--eps_jobs', help = 'Number of parallel jobs used to estimate Epsilon. The default value is the number of jobs', required = False)
+    parser.add_argument('--eps_report', help = 'Compare the sampled Epsilon estimation to the exact one', action='store_true')
+    parser.add_argument('-a', '--process_aggregates', help = 'Add per PID mean/max %%CPU, POWER and CYCLES over all the snapshots of an os_processes file', action='store_true')
+    parser.add_argument('-i', '--live_processes', help = 'Collect the OS processes table of this host instead of reading a top output file', action='store_true')
+    parser.add_argument('-w', '--window', help = 'Detect separately in time windows of this duration (e.g. 1h, 1d)', required = False)
+    parser.add_argument('--window_workers', help = 'Number of processes clustering the time windows in parallel. The default value is the number of CPUs', required = False)
+    parser.add_argument('-k', '--client_level', help = 'Cluster client sessions (by ip, or by ip and user agent) instead of log lines', choices = ['ip', 'ip_user_agent'], required = False)
+    parser.add_argument('-d', '--deduplicate', help = 'Collapse identical feature vectors and cluster them with sample weights', action='store_true')
+    parser.add_argument('-g', '--dbscan_engine', help = 'DBSCAN implementation: sklearn, or grid (grid indexed DBSCAN of the 2 dimensions PCA space, same labels with a bounded memory)', choices = ['sklearn', 'grid'], default = 'sklearn')
+    parser.add_argument('-n', '--jobs', help = 'Number of parallel jobs of the nearest neighbors, DBSCAN and silhouette stages (-1 uses all the CPUs)', required = False)
+    parser.add_argument('--serve', help = 'Fit the model on the log file and serve the findings of log line batches on HOST:PORT, PORT (loopback) or unix:PATH', required = False)
+    parser.add_argument('--serve_concurrency', help = 'Maximum number of batches scored at the same time by the service. The default value is 4', required = False)
+    parser.add_argument('--blas_threads', help = 'Maximum number of BLAS/OpenMP threads used by the numerical stages (PCA, distances)', required = False)
     urllib3.disable_warnings()
 
     # Get parameters
     args = vars(parser.parse_args())
+    if args['live_processes']:
+        if args['log_type'] != 'os_processes':
+            parser.error('--live_processes requires the os_processes log type')
+        args['log_file'] = args['log_file'] if args['log_file'] is not None else 'live_os_processes'
+    elif args['log_file'] is None:
+        parser.error('the following arguments are required: -l/--log_file')
+    if args['window'] is not None and args['log_type'] == 'os_processes':
+        parser.error('--window is only supported for http logs')
+    if args['window'] is not None:
+        try:
+            window_duration = pd.to_timedelta(args['window'])
+        except ValueError:
+            window_duration = None
+        if window_duration is None or window_duration <= pd.Timedelta(0):
+            parser.error('--window should be a positive duration (e.g. 30min, 1h, 1d)')
+    if args['client_level'] is not None and (args['log_type'] == 'os_processes' or args['window'] is not None or args['find_cves']):
+        parser.error('--client_level is only supported for http logs, without --window and --find_cves')
+    if args['serve'] is not None and (args['log_type'] == 'os_processes' or args['window'] is not None or args['client_level'] is not None):
+        parser.error('--serve is only supported for http logs, without --window and --client_level')
 
 
     logging_level = logging.DEBUG if args['debug'] else logging.INFO
     logging.basicConfig(level=logging_level)
 
+    # Parallelism settings (command line or settings.conf)
+    args['jobs'], args['blas_threads'] = get_parallelism_settings(args['jobs'], args['blas_threads'])
+    threadpoolctl.threadpool_limits(limits=args['blas_threads'])
+
 
     LOG_LINES_LIMIT = int(args['log_lines_limit']) if args['log_lines_limit'] is not None else 1000000
-    LAMBDA = float(args['opt_lamda']) if args['opt_lamda'] is not None else 0.01
     THRESHOLD = int(args['minority_threshold']) if args['minority_threshold'] else 5
 
     encoding_type = 'label_encoding' if args['label_encoding'] == True else 'fraction_encoding'
@@ -300,6 +903,21 @@ def main():
         'log_line',
         ]
 
+    if args['client_level'] is not None:
+        FEATURES = [
+            'requests',
+            'request_rate',
+            'distinct_urls',
+            'error_ratio',
+            'mean_special_chars',
+            'mean_length',
+            'get_ratio',
+            'post_ratio',
+            'head_ratio',
+            'other_method_ratio',
+            'log_line',
+            ]
+
 
     print('\n')
     print((termcolor.colored(pyfiglet.figlet_format('Webhawk / Catch 2.0',font = 'banner3', width=600), color='yellow')))
@@ -310,6 +928,36 @@ def main():
     logging.info('{}Log format is set to {}'.format(' '*4,args['log_type']))
     logging.info('{}Demo plotting is set to {}'.format(' '*4,args['show_plots']))
     logging.info('{}Features standarization is set to {}'.format(' '*4,args['standardize_data']))
+    logging.info('{}Deduplication is set to {}'.format(' '*4,args['deduplicate']))
+    logging.info('{}DBSCAN engine is set to {}'.format(' '*4,args['dbscan_engine']))
+    logging.info('{}Parallel jobs are set to {}'.format(' '*4,args['jobs']))
+    logging.info('{}BLAS/OpenMP threads are set to {}'.format(' '*4,args['blas_threads']))
+    for thread_pool in threadpoolctl.threadpool_info():
+        logging.info('{}{} ({}) uses {} threads'.format(' '*8,thread_pool['prefix'],thread_pool['internal_api'],thread_pool['num_threads']))
+
+    if args['serve'] is not None:
+        logging.info('\n> Fitting the scoring model on {}'.format(args['log_file']))
+        model = fit_scoring_model(args, FEATURES, encoding_type, LOG_LINES_LIMIT, THRESHOLD)
+        logging.info('{}{} reference log lines, {} clusters, Epsilon {}'.format(4*' ', model['info']['reference_log_lines'], model['info']['clusters'], model['eps']))
+        logging.info('\n> Scoring service started')
+        SERVE_CONCURRENCY = int(args['serve_concurrency']) if args['serve_concurrency'] is not None else 4
+        service.serve(args['serve'], lambda log_lines: score_log_lines(model, log_lines), model['info'], SERVE_CONCURRENCY)
+        return
+
+    if args['window'] is not None:
+        logging.info('\n> Time windowed detection started')
+        windows, high_findings, medium_findings = detect_by_window(args, FEATURES, encoding_type, LOG_LINES_LIMIT)
+        if len(high_findings)>0:
+            logging.info ('\n\n\n\n    '+100*'/'+'   HIGH Severity findings   '+100*'\\')
+            print_findings(high_findings, args['log_type'])
+        if len(medium_findings) > 0:
+            logging.info ('\n\n\n\n    '+100*'/'+'   MEDIUM Severity findings   '+100*'\\')
+            print_findings(medium_findings, args['log_type'])
+        logging.info('\nNumber of time windows:{}'.format(len(windows)))
+        logging.info('{} log lines detected as containing potential malicious behaviour traces'.format(len(high_findings)))
+        logging.info('\nTotal number of log lines:{}'.format(sum(len(window['log_lines']) for window in windows)))
+        report_findings(high_findings + medium_findings, args)
+        return
 
     # Get data
     logging.info('\n> Data reading started')
@@ -320,105 +968,46 @@ def main():
         args['log_type'],
         LOG_LINES_LIMIT,
         FEATURES,
-        encoding_type)
+        encoding_type,
+        args['process_aggregates'],
+        args['live_processes'],
+        args['client_level'])
 
     print(data)
 
-    # convert to a dataframe
-    if args['log_type'] != 'os_processes':
-        dataframe = data.to_numpy()[:,list(range(0,len(FEATURES)-1))]
-    else:
-        dataframe = data
-
-    # Standarize data
-    if args['standardize_data']:
-        dataframe = sklearn.preprocessing.StandardScaler().fit_transform(dataframe)
-
     # Show informative data plots
     if args['show_plots']:
         logging.info('\n> Informative plotting started')
-        if args['log_type'] != 'os_processes':
+        if args['client_level'] is not None:
+            plot_data([data['request_rate'],data['error_ratio']],'Informative plot of request_rate and error_ratio')
+            plot_data([data['request_rate'],data['error_ratio'],data['distinct_urls']],'Informative plot of request_rate, error_ratio and distinct_urls')
+        elif args['log_type'] != 'os_processes':
             plot_data([data['http_query'],data['url_depth']],'Informative plot of http_query and url_depth')
             plot_data([data['http_query'],data['url_depth'],data['return_code']],'Informative plot of http_query, url_depth and return_code')
+        elif args['live_processes']:
+            plot_data([data['%CPU'],data['%MEM']],'Plotting %CPU and %MEM')
+            plot_data([data['%CPU'],data['%MEM'],data['CSW']],'Plotting %CPU, %MEM and CSW')
         else:
             plot_data([data['%CPU'],data['POWER']],'Plotting %CPU and POWER')
             plot_data([data['%CPU'],data['POWER'],data['CYCLES']],'Plotting %CPU, POWER and CYCLES')
 
-
-    # Dimensiality reduction to 2d using PCA
-    pca = sklearn.decomposition.PCA(n_components=2)
-    principal_components_df = pca.fit_transform(dataframe)
-    dataframe = pd.DataFrame(
-        data = principal_components_df,
-        columns = ['pc_1', 'pc_2'])
-
-    # Display and plot data after applying PCA
-    print(dataframe)
-    plot_data([dataframe['pc_1'],dataframe['pc_2']],'Data after dimensiality reduction using PCA')
-
-
-    # Getting or setting epsilon
-    if args['eps'] == None:
-        logging.info('\n> No Epsilon input. Finding the max sorted neighbors curvature point and use it as Epsilon')
-        automatic_max_curve_point = find_max_curvature_point(dataframe, args['show_plots'])
-        selected_eps = automatic_max_curve_point
-        logging.info('{}{}'.format(4*' ',automatic_max_curve_point))
-    else:
-        selected_eps=float(args['eps'])
-
-    if args['opt_silouhette']:
-        logging.info('\n> Optimizing Epsilon to get the best BDSCAN Silhouette Coefficient')
-        best_silouhette, best_eps_for_silouhette = optimize_silouhette_coefficient(selected_eps, dataframe, LAMBDA)
-        logging.info('{}{}'.format(4*' ', best_eps_for_silouhette))
-        selected_eps = best_eps_for_silouhette
-
-    logging.info('{}The value {} will be used as final DBSCAN Epsilon'.format(4*' ', selected_eps))
-
-    logging.info('\n> Starting detection..')
-    # Use dbscan for clustering and train the model
-
-    if args['eps'] == None and args['min_samples'] == None:
-        dbscan = sklearn.cluster.DBSCAN(eps=selected_eps)
-    elif args['eps'] == None:
-        dbscan = sklearn.cluster.DBSCAN(eps=selected_eps, min_samples=int(args['min_samples']))
-    elif args['min_samples'] == None:
-        dbscan = sklearn.cluster.DBSCAN(eps=selected_eps)
-    else:
-        dbscan = sklearn.cluster.DBSCAN(eps=selected_eps, min_samples=int(args['min_samples']))
-    dbscan_model = dbscan.fit(dataframe)
-
-    # Check the number of labels (if 1 then try without EPS value)
-    if len(set(dbscan_model.labels_)) == 1:
-        logging.info('{}Only one cluster was found using the value {} as epsilon'.format(4*' ',selected_eps))
-        logging.info('{}Trying without epsilon'.format(4*' '))
-        dbscan = sklearn.cluster.DBSCAN()
-        dbscan_model = dbscan.fit(dataframe)
-    if len(set(dbscan_model.labels_)) == 1:
-        logging.info('{}Only one cluster was found without an epsilon value. Exiting.'.format(4*' '))
+    clustering = cluster_data(data, args, FEATURES)
+    if clustering is None:
+        logging.info('{}Exiting.'.format(4*' '))
         sys.exit(0)
+    dataframe = clustering['dataframe']
+    unique_labels = clustering['unique_labels']
+    labels = clustering['labels']
+    sample_weight = clustering['sample_weight']
 
-    # Get point labels
-    labels = dbscan_model.labels_
-
-    elements_by_cluster = find_elements_by_cluster(labels)
-    number_of_clusters = len(elements_by_cluster.values())
-
-    # Get top minority clusters
-    minority_clusters = get_minority_clusters(elements_by_cluster,THRESHOLD)
+    high_findings, medium_findings, minority_clusters = get_findings(labels, data, args['log_type'], THRESHOLD)
 
     # Outliers are considred as high severity findings
-
-    high_findings = catch(labels,data,-1, args['log_type'])
     if len(high_findings)>0:
         logging.info ('\n\n\n\n    '+100*'/'+'   HIGH Severity findings   '+100*'\\')
         print_findings(high_findings, args['log_type'])
 
     # Points belonging to minority clusters are considred as medium severity findings
-    medium_findings=[]
-    for label in minority_clusters:
-        if label != -1:
-            medium_findings += catch(labels,data,label, args['log_type'])
-
     if len(medium_findings) > 0:
         logging.info ('\n\n\n\n    '+100*'/'+'   MEDIUM Severity findings   '+100*'\\')
         print_findings(medium_findings, args['log_type'])
@@ -432,10 +1021,10 @@ def main():
 
     logging.info('\nEstimated number of clusters: %d' % len(set(labels)))
     logging.info('Estimated number of outliers/anomalous points: %d' % n_noise)
-    logging.info('DBSCAN Silhouette Coefficient: %0.3f' % sklearn.metrics.silhouette_score(dataframe, labels))
+    logging.info('DBSCAN Silhouette Coefficient: %0.3f' % get_silhouette_score(dataframe, unique_labels, sample_weight, args['jobs']))
     logging.info('{} log lines detected as containing potential malicious behaviour traces'.format(list(labels).count(-1)))
     logging.info('Number of log lines by cluster:{}'.format(find_elements_by_cluster(labels)))
-    logging.info('\nTotal number of log lines:{}'.format(len(data)))
+    logging.info('\nTotal number of {}:{}'.format('log lines' if args['client_level'] is None else 'clients', len(data)))
     if len(minority_clusters)>0:
         logging.info('The minority clusters are:{}'.format(minority_clusters))
     else:
@@ -445,18 +1034,9 @@ def main():
     save_plot_at ='./SCANS/scan_plot_{}'.format(args['log_file'].split('/')[-1].replace('.','_'))
 
     # plot findings and save the plot if save_plot_at is defined
-    plot_findings(dataframe,labels,save_plot_at)
+    plot_findings(dataframe,unique_labels,save_plot_at,sample_weight)
 
-    if args['find_cves'] == True:
-        logging.info('> Finding CVEs started')
-        all_findings = find_cves(all_findings)
-    # Generate a HTML report if requested
-    if args['report']:
-        #find_cves(all_findings)
-        gen_report(
-            all_findings,args['log_file'],
-            args['log_type'],
-            )
+    report_findings(all_findings, args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,265 @@
+# Webhawk/Catch 2.0 grid DBSCAN
+# About: DBSCAN specialized for the 2 dimensions PCA space, using a uniform grid of cells instead of a neighbors tree
+# The labels, core samples and components are the same as the ones of sklearn.cluster.DBSCAN with the euclidean metric
+
+
+import numpy as np
+
+
+# Cell offsets of the neighbor cells (the cell side is Epsilon/sqrt(2), so the neighbors of a point are at most 2 cells away)
+NEIGHBOR_CELL_OFFSETS = [(di, dj) for di in range(-2, 3) for dj in range(-2, 3)]
+
+# Half of the non null offsets (each pair of neighbor cells is checked once)
+FORWARD_CELL_OFFSETS = [(di, dj) for di, dj in NEIGHBOR_CELL_OFFSETS if di > 0 or (di == 0 and dj > 0)]
+
+# Number of cells along an axis above which the empty gaps of the axis are shrunk (keeps the cell keys in 64 bits)
+MAX_AXIS_CELLS = 2**30
+
+
+class GridDBSCAN:
+
+    def __init__(self, eps=0.5, min_samples=5, chunk_size=2**20):
+        self.eps = eps
+        self.min_samples = min_samples
+        # Maximum number of point pairs of which the distances are computed at once
+        self.chunk_size = chunk_size
+
+    def fit(self, X, sample_weight=None):
+        X = np.asarray(X, dtype=float)
+        if X.ndim != 2 or X.shape[1] != 2:
+            raise ValueError('GridDBSCAN only clusters 2 dimensions data, got data of shape {}'.format(X.shape))
+        if not np.isfinite(X).all():
+            raise ValueError('GridDBSCAN input contains NaN or infinity')
+        if not self.eps > 0:
+            raise ValueError('The eps parameter should be positive, got {}'.format(self.eps))
+        weights = np.ones(len(X)) if sample_weight is None else np.asarray(sample_weight, dtype=float).reshape(-1)
+        if len(weights) != len(X) or not np.isfinite(weights).all():
+            raise ValueError('sample_weight should hold one finite weight by point')
+        labels = np.full(len(X), -1, dtype=np.intp)
+        is_core = np.zeros(len(X), dtype=bool)
+        if len(X) > 0:
+            grid = get_grid(X, self.eps)
+            order = grid['order']
+            sorted_X = X[order]
+            sorted_weights = weights[order]
+            sorted_is_core = get_core_points(grid, sorted_X, sorted_weights, self.eps, self.min_samples, self.chunk_size)
+            sorted_labels = get_core_labels(grid, sorted_X, sorted_is_core, self.eps, self.chunk_size)
+            set_border_labels(grid, sorted_X, sorted_is_core, sorted_labels, self.eps, self.chunk_size)
+            labels[order] = sorted_labels
+            is_core[order] = sorted_is_core
+        self.core_sample_indices_ = np.flatnonzero(is_core)
+        self.labels_ = labels
+        self.components_ = X[self.core_sample_indices_].copy()
+        return self
+
+    def fit_predict(self, X, sample_weight=None):
+        return self.fit(X, sample_weight).labels_
+
+
+# This function puts the points in the cells of a uniform grid and sorts them by cell
+def get_grid(X, eps):
+    # Any two points of a cell are closer than Epsilon (with a margin for the rounding errors)
+    cell_side = eps/np.sqrt(2)*(1-1e-9)
+    cell_coordinates = np.stack([get_axis_cells(X[:,axis], eps, cell_side) for axis in range(2)], axis=1)
+    # The cell keys are padded by 2 cells so that the keys of the neighbor cells never wrap around
+    width = int(cell_coordinates[:,1].max())+5
+    if (int(cell_coordinates[:,0].max())+5)*width >= 2**62:
+        raise ValueError('GridDBSCAN cannot index the grid of {} points'.format(len(X)))
+    point_keys = (cell_coordinates[:,0]+2)*width+cell_coordinates[:,1]+2
+    order = np.argsort(point_keys, kind='stable')
+    cell_keys, cell_starts, cell_counts = np.unique(point_keys[order], return_index=True, return_counts=True)
+    return {
+        'order': order,
+        'width': width,
+        'cell_keys': cell_keys,
+        'cell_starts': cell_starts,
+        'cell_counts': cell_counts,
+        # Cell of each point (sorted by cell)
+        'point_cells': np.repeat(np.arange(len(cell_keys)), cell_counts),
+    }
+
+
+# This function returns the cell coordinate of the points along an axis
+# When the axis spans more than MAX_AXIS_CELLS cells (a tiny Epsilon over a wide range), the empty gaps wider than
+# 2 Epsilon are shrunk to 3 cells: the points on both sides of such a gap are not neighbors and neither are their cells,
+# and the coordinates stay lower than 3 cells by point
+def get_axis_cells(values, eps, cell_side):
+    cells = np.floor((values-values.min())/cell_side)
+    if cells.max() < MAX_AXIS_CELLS:
+        return cells.astype(np.int64)
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+    run_starts = np.concatenate([[0], np.flatnonzero(np.diff(sorted_values) > 2*eps)+1])
+    runs = np.repeat(np.arange(len(run_starts)), np.diff(np.append(run_starts, len(values))))
+    run_cells = np.floor((sorted_values-sorted_values[run_starts][runs])/cell_side).astype(np.int64)
+    # Each run of points starts 3 cells after the last cell of the previous run
+    run_widths = np.maximum.reduceat(run_cells, run_starts)+3
+    run_offsets = np.cumsum(run_widths)-run_widths
+    cells = np.empty(len(values), dtype=np.int64)
+    cells[order] = run_cells+run_offsets[runs]
+    return cells
+
+
+# This function returns the pairs of cells (from the given cells) at the given offset
+def get_neighbor_cells(grid, cells, offset):
+    cell_keys = grid['cell_keys']
+    neighbor_keys = cell_keys[cells]+offset[0]*grid['width']+offset[1]
+    neighbor_cells = np.minimum(np.searchsorted(cell_keys, neighbor_keys), len(cell_keys)-1)
+    found = cell_keys[neighbor_cells] == neighbor_keys
+    return cells[found], neighbor_cells[found]
+
+
+# This function returns the points of a subset (boolean mask of the sorted points) by cell, and their bounding box
+def get_cell_members(grid, X, mask):
+    members = np.flatnonzero(mask)
+    counts = np.bincount(grid['point_cells'][members], minlength=len(grid['cell_keys']))
+    starts = np.cumsum(counts)-counts
+    boxes = np.zeros((len(counts), 4))
+    if len(members) > 0:
+        boxes[counts > 0, :2] = np.minimum.reduceat(X[members], starts[counts > 0])
+        boxes[counts > 0, 2:] = np.maximum.reduceat(X[members], starts[counts > 0])
+    return members, starts, counts, boxes
+
+
+# This function returns the position of each element in its group
+def get_group_ranges(counts):
+    return np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)
+
+
+# This function yields the pairs of points of the pairs of cells whose distance is lower than or equal to Epsilon
+# The distances are computed by chunks of at most chunk_size pairs (unless a single point has more candidate neighbors)
+# The pairs of cells for which skip_pairs returns True (checked before each chunk) are not checked anymore
+def iterate_close_pairs(cells_a, cells_b, members_a, members_b, X, eps, chunk_size, skip_pairs=None):
+    points_a, starts_a, counts_a, _ = members_a
+    points_b, starts_b, counts_b, boxes_b = members_b
+    keep = (counts_a[cells_a] > 0) & (counts_b[cells_b] > 0)
+    cells_a, cells_b = cells_a[keep], cells_b[keep]
+    first_a, rows, first_b, columns = starts_a[cells_a], counts_a[cells_a], starts_b[cells_b], counts_b[cells_b]
+    sizes = rows*columns
+    cumulated_sizes = np.cumsum(sizes)
+    start = 0
+    while start < len(sizes):
+        base = cumulated_sizes[start-1] if start > 0 else 0
+        end = max(int(np.searchsorted(cumulated_sizes, base+chunk_size, side='right')), start+1)
+        if end == start+1 and sizes[start] > chunk_size:
+            # The rows of a single large pair of cells are split
+            # (in blocks of growing size if the pair can be skipped, as a single close pair may be enough)
+            max_block_rows = max(1, chunk_size//columns[start])
+            block_rows = 1 if skip_pairs is not None else max_block_rows
+            block_start = 0
+            while block_start < rows[start]:
+                if skip_pairs is not None and skip_pairs(cells_a[start:end], cells_b[start:end])[0]:
+                    break
+                block = np.array([first_a[start]+block_start]), np.array([min(block_rows, rows[start]-block_start)])
+                yield get_close_pairs(block[0], block[1], first_b[start:end], columns[start:end], boxes_b[cells_b[start:end]], points_a, points_b, X, eps)
+                block_start += block_rows
+                block_rows = min(2*block_rows, max_block_rows)
+        else:
+            group = np.arange(start, end)
+            if skip_pairs is not None:
+                group = group[~skip_pairs(cells_a[group], cells_b[group])]
+            yield get_close_pairs(first_a[group], rows[group], first_b[group], columns[group], boxes_b[cells_b[group]], points_a, points_b, X, eps)
+        start = end
+
+
+# This function returns the pairs of points (all the points of a range of points_a with all the points of a range of points_b)
+# whose distance is lower than or equal to Epsilon
+def get_close_pairs(first_a, rows, first_b, columns, boxes_b, points_a, points_b, X, eps):
+    row_pairs = np.repeat(np.arange(len(rows)), rows)
+    row_points = points_a[first_a[row_pairs]+get_group_ranges(rows)]
+    # The points farther than Epsilon from the bounding box of the points of the other cell are skipped
+    box_differences = np.maximum(np.maximum(boxes_b[row_pairs, :2]-X[row_points], X[row_points]-boxes_b[row_pairs, 2:]), 0)
+    close_rows = box_differences[:,0]*box_differences[:,0]+box_differences[:,1]*box_differences[:,1] <= eps*eps
+    row_pairs, row_points = row_pairs[close_rows], row_points[close_rows]
+    row_columns = columns[row_pairs]
+    pair_rows = np.repeat(np.arange(len(row_pairs)), row_columns)
+    pair_a = row_points[pair_rows]
+    pair_b = points_b[np.repeat(first_b[row_pairs], row_columns)+get_group_ranges(row_columns)]
+    # Same comparison of the squared distances as the sklearn neighbors trees
+    differences = X[pair_a]-X[pair_b]
+    close = differences[:,0]*differences[:,0]+differences[:,1]*differences[:,1] <= eps*eps
+    return pair_a[close], pair_b[close]
+
+
+# This function returns the core points (the points whose neighborhood weight is at least min_samples)
+def get_core_points(grid, X, weights, eps, min_samples, chunk_size):
+    point_cells = grid['point_cells']
+    cell_weights = np.bincount(point_cells, weights=weights, minlength=len(grid['cell_keys']))
+    # All the points of a cell are neighbors, so the points of the cells weighting at least min_samples are core points
+    # (unless there are negative weights)
+    if (weights >= 0).all():
+        dense_cells = cell_weights >= min_samples
+    else:
+        dense_cells = np.zeros(len(cell_weights), dtype=bool)
+    is_core = dense_cells[point_cells]
+    # The neighborhood weight of the other points is computed
+    all_members = get_cell_members(grid, X, np.ones(len(X), dtype=bool))
+    sparse_members = get_cell_members(grid, X, ~is_core)
+    sparse_cells = np.flatnonzero(~dense_cells)
+    neighborhood_weights = np.zeros(len(X))
+    for offset in NEIGHBOR_CELL_OFFSETS:
+        cells_a, cells_b = get_neighbor_cells(grid, sparse_cells, offset)
+        for pair_a, pair_b in iterate_close_pairs(cells_a, cells_b, sparse_members, all_members, X, eps, chunk_size):
+            neighborhood_weights += np.bincount(pair_a, weights=weights[pair_b], minlength=len(X))
+    return is_core | (neighborhood_weights >= min_samples)
+
+
+# This function returns the root cells of the union-find forest (the roots are the cells pointing to themselves)
+def find_root_cells(parents, cells):
+    roots = parents[cells]
+    while True:
+        next_roots = parents[roots]
+        if np.array_equal(next_roots, roots):
+            return roots
+        roots = next_roots
+
+
+# This function merges the components of the pairs of cells (a root always points to a lower cell so there are no cycles)
+def union_cells(parents, cells_a, cells_b):
+    while len(cells_a) > 0:
+        roots_a = find_root_cells(parents, cells_a)
+        roots_b = find_root_cells(parents, cells_b)
+        split = roots_a != roots_b
+        cells_a, cells_b, roots_a, roots_b = cells_a[split], cells_b[split], roots_a[split], roots_b[split]
+        np.minimum.at(parents, np.maximum(roots_a, roots_b), np.minimum(roots_a, roots_b))
+
+
+# This function labels the core points, the clusters being the connected components of the core cells
+# The clusters are numbered by their lowest core point index (like in sklearn)
+def get_core_labels(grid, X, is_core, eps, chunk_size):
+    labels = np.full(len(X), -1, dtype=np.intp)
+    if not is_core.any():
+        return labels
+    point_cells = grid['point_cells']
+    core_members = get_cell_members(grid, X, is_core)
+    core_cells = np.flatnonzero(core_members[2] > 0)
+    parents = np.arange(len(grid['cell_keys']))
+    for offset in FORWARD_CELL_OFFSETS:
+        cells_a, cells_b = get_neighbor_cells(grid, core_cells, offset)
+        # The pairs of cells that are already connected are not checked
+        connected = lambda cells_a, cells_b: find_root_cells(parents, cells_a) == find_root_cells(parents, cells_b)
+        for pair_a, pair_b in iterate_close_pairs(cells_a, cells_b, core_members, core_members, X, eps, chunk_size, connected):
+            union_cells(parents, point_cells[pair_a], point_cells[pair_b])
+    core_points = core_members[0]
+    core_roots = find_root_cells(parents, point_cells[core_points])
+    lowest_indices = np.full(len(parents), len(X))
+    np.minimum.at(lowest_indices, core_roots, grid['order'][core_points])
+    roots = np.unique(core_roots)
+    root_labels = np.zeros(len(parents), dtype=np.intp)
+    root_labels[roots[np.argsort(lowest_indices[roots])]] = np.arange(len(roots))
+    labels[core_points] = root_labels[core_roots]
+    return labels
+
+
+# This function labels the border points with the lowest label of their core neighbors (the first cluster reaching them in sklearn)
+def set_border_labels(grid, X, is_core, labels, eps, chunk_size):
+    core_members = get_cell_members(grid, X, is_core)
+    other_members = get_cell_members(grid, X, ~is_core)
+    other_cells = np.flatnonzero(other_members[2] > 0)
+    border_labels = np.full(len(X), len(X), dtype=np.intp)
+    for offset in NEIGHBOR_CELL_OFFSETS:
+        cells_a, cells_b = get_neighbor_cells(grid, other_cells, offset)
+        for pair_a, pair_b in iterate_close_pairs(cells_a, cells_b, other_members, core_members, X, eps, chunk_size):
+            np.minimum.at(border_labels, pair_a, labels[pair_b])
+    border = border_labels < len(X)
+    labels[border] = border_labels[border]
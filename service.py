@@ -0,0 +1,178 @@
+# Webhawk/Catch 2.0 scoring service
+# About: Serve the findings of a fitted model over a local HTTP or Unix socket endpoint
+
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import threading
+import collections
+import socketserver
+import http.server
+
+
+# Maximum number of log lines by scoring request
+MAX_BATCH_LINES = 100000
+
+# Maximum size of the body of a scoring request, checked before reading it (about 1 KB by line of a full batch)
+MAX_BODY_BYTES = 128*1024*1024
+
+# Number of recent scoring requests used to compute the latency percentiles
+LATENCY_WINDOW = 1000
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ScoringRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'model': self.server.model_info})
+        elif self.path == '/metrics':
+            self.send_json(200, get_metrics(self.server))
+        else:
+            self.send_json(404, {'error': 'Unknown endpoint {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self.send_json(404, {'error': 'Unknown endpoint {}'.format(self.path)})
+            return
+        try:
+            content_length = int(self.headers['Content-Length'])
+        except:
+            content_length = -1
+        if content_length < 0:
+            self.send_json(411, {'error': 'A valid Content-Length header is required'})
+            return
+        if content_length > MAX_BODY_BYTES:
+            # The body is not read, the connection can not be reused
+            self.close_connection = True
+            self.send_json(413, {'error': 'A request body can be at most {} bytes'.format(MAX_BODY_BYTES)})
+            return
+        try:
+            log_lines = read_log_lines(self, content_length)
+        except:
+            self.send_json(400, {'error': 'The body should be a JSON object with a "lines" list or plain text log lines'})
+            return
+        if len(log_lines) > MAX_BATCH_LINES:
+            self.send_json(413, {'error': 'A batch can include at most {} log lines'.format(MAX_BATCH_LINES)})
+            return
+        # Bounded concurrency: the requests wait for a free scoring slot
+        if not self.server.scoring_slots.acquire(timeout=self.server.queue_timeout):
+            update_metrics(self.server, rejected_requests=1)
+            self.send_json(503, {'error': 'All the scoring slots are busy'})
+            return
+        update_metrics(self.server, in_flight=1)
+        start = time.monotonic()
+        try:
+            result = self.server.score_function(log_lines)
+        except:
+            logging.info('{}Something went wrong scoring a batch of {} log lines'.format(4*' ', len(log_lines)))
+            update_metrics(self.server, errors=1)
+            self.send_json(500, {'error': 'Something went wrong scoring the log lines'})
+            return
+        finally:
+            update_metrics(self.server, in_flight=-1)
+            self.server.scoring_slots.release()
+        seconds = time.monotonic() - start
+        update_metrics(self.server, requests=1, lines=len(log_lines), findings=len(result['findings']), scoring_seconds=seconds, latency=seconds)
+        result['seconds'] = seconds
+        self.send_json(200, result)
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('{}{}'.format(4*' ', format % args))
+
+
+# Read the log lines of a scoring request (a JSON object with a "lines" list, or plain text lines)
+def read_log_lines(request_handler, content_length):
+    body = request_handler.rfile.read(content_length).decode('utf-8')
+    if request_handler.headers.get('Content-Type', '').startswith('application/json'):
+        log_lines = json.loads(body)['lines']
+        if not isinstance(log_lines, list) or not all(isinstance(log_line, str) for log_line in log_lines):
+            raise ValueError('lines should be a list of strings')
+        return log_lines
+    return body.splitlines()
+
+
+# Add to the counters of the service and record the latency of a scoring request
+def update_metrics(server, latency=None, **counters):
+    with server.metrics_lock:
+        for counter in counters:
+            server.metrics[counter] += counters[counter]
+        if latency is not None:
+            server.latencies.append(latency)
+
+
+# Get the counters, the throughput and the latency percentiles of the service
+def get_metrics(server):
+    with server.metrics_lock:
+        metrics = dict(server.metrics)
+        latencies = sorted(server.latencies)
+    uptime = time.monotonic() - server.started
+    metrics['uptime_seconds'] = uptime
+    metrics['lines_per_second'] = metrics['lines']/uptime
+    metrics['scoring_lines_per_second'] = metrics['lines']/metrics['scoring_seconds'] if metrics['scoring_seconds'] > 0 else None
+    metrics['latency_ms'] = {}
+    if len(latencies) > 0:
+        metrics['latency_ms']['mean'] = 1000*sum(latencies)/len(latencies)
+        for percentile in [50, 95, 99]:
+            metrics['latency_ms']['p{}'.format(percentile)] = 1000*latencies[min(len(latencies)-1, len(latencies)*percentile//100)]
+        metrics['latency_ms']['max'] = 1000*latencies[-1]
+    return metrics
+
+
+# Serve a scoring function on HOST:PORT (or PORT on the loopback interface) or on unix:PATH
+def serve(address, score_function, model_info, concurrency=4, queue_timeout=30):
+    socket_path = None
+    try:
+        if address.startswith('unix:'):
+            socket_path = address[len('unix:'):]
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            server = ThreadingUnixHTTPServer(socket_path, ScoringRequestHandler)
+        else:
+            host, port = address.rsplit(':', 1) if ':' in address else ('127.0.0.1', address)
+            server = http.server.ThreadingHTTPServer((host, int(port)), ScoringRequestHandler)
+    except:
+        logging.info('Something went wrong listening on {}'.format(address))
+        sys.exit(1)
+    server.score_function = score_function
+    server.model_info = model_info
+    server.scoring_slots = threading.BoundedSemaphore(concurrency)
+    server.queue_timeout = queue_timeout
+    server.started = time.monotonic()
+    server.metrics_lock = threading.Lock()
+    server.metrics = {
+        'requests': 0,
+        'lines': 0,
+        'findings': 0,
+        'errors': 0,
+        'rejected_requests': 0,
+        'in_flight': 0,
+        'scoring_seconds': 0.0,
+    }
+    server.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+    logging.info('{}Listening on {} with {} scoring slots'.format(4*' ', address, concurrency))
+    # Stop cleanly (closing the socket) when the daemon is terminated
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info('{}Scoring service stopped'.format(4*' '))
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,75 @@
+# Webhawk/Catch 2.0 Epsilon estimation tests
+# About: Compare estimate_max_curvature_point to find_max_curvature_point on the sample Apache logs
+
+
+import os
+import sys
+import logging
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+SETTINGS = r'''[FEATURES]
+features:length,params_number,return_code,size,upper_cases,lower_cases,special_chars,url_depth,user_agent,http_query,ip
+
+[LOG]
+apache:([(\d\.)]+) - - \[(.*?)\] "(.*?)" (\d+) (.+) "(.*?)" "(.*?)"
+'''
+
+FEATURES = ['params_number', 'length', 'upper_cases', 'lower_cases', 'special_chars', 'url_depth', 'user_agent', 'http_query', 'ip', 'return_code', 'log_line']
+
+LOGS = ['access.log.2021-10-22', 'access.log.2022-12-22']
+
+
+# The utilities module reads settings.conf from the working directory when it is imported
+@pytest.fixture(scope='module')
+def catch(tmp_path_factory):
+    settings_dir = tmp_path_factory.mktemp('settings')
+    (settings_dir/'settings.conf').write_text(SETTINGS)
+    cwd = os.getcwd()
+    os.chdir(settings_dir)
+    try:
+        import catch
+    finally:
+        os.chdir(cwd)
+    return catch
+
+
+# This function returns the 2 dimensions PCA projection of a sample log, as computed by cluster_data
+@pytest.fixture(scope='module', params=[(log, standardize) for log in LOGS for standardize in [False, True]], ids=lambda param: '{}-{}'.format(*param))
+def dataframe(request, catch):
+    log, standardize = request.param
+    data = catch.get_data(os.path.join(ROOT, 'SAMPLE_DATA', 'RAW_APACHE_LOGS', log), 'apache', 1000000, FEATURES, 'fraction_encoding')
+    values = data.to_numpy()[:,list(range(0,len(FEATURES)-1))]
+    if standardize:
+        values = catch.sklearn.preprocessing.StandardScaler().fit_transform(values)
+    return catch.sklearn.decomposition.PCA(n_components=2).fit_transform(values)
+
+
+def test_unsampled_estimation_is_exact(catch, dataframe):
+    exact_eps = float(catch.find_max_curvature_point(dataframe, False))
+    assert catch.estimate_max_curvature_point(dataframe, False, refresh_cache=True) == exact_eps
+    assert catch.estimate_max_curvature_point(dataframe, False, len(dataframe), len(dataframe), refresh_cache=True) == exact_eps
+
+
+@pytest.mark.parametrize('sample_size', [None, 20, 100, 300])
+@pytest.mark.parametrize('curve_points', [None, 50, 100, 1000])
+def test_report_flags_the_gap(catch, dataframe, sample_size, curve_points, caplog):
+    exact_eps = float(catch.find_max_curvature_point(dataframe, False))
+    sampled_eps = catch.estimate_max_curvature_point(dataframe, False, sample_size, curve_points, refresh_cache=True)
+    with caplog.at_level(logging.INFO):
+        exact, sampled = catch.report_eps_estimation(dataframe, sample_size, curve_points)
+    assert exact['eps'] == exact_eps
+    assert exact['relative_error'] == 0
+    assert not exact['flagged']
+    assert sampled['eps'] == sampled_eps
+    if sampled_eps is None:
+        assert sampled['relative_error'] is None
+        assert sampled['flagged']
+    else:
+        assert sampled['relative_error'] == pytest.approx(abs(sampled_eps-exact_eps)/exact_eps)
+        assert sampled['flagged'] == (sampled['relative_error'] > catch.EPS_REPORT_TOLERANCE)
+    warnings = [record for record in caplog.records if record.levelno == logging.WARNING]
+    assert len(warnings) == int(sampled['flagged'])
@@ -0,0 +1,161 @@
+# Webhawk/Catch 2.0 grid DBSCAN tests
+# About: Compare the labels, core samples and components of GridDBSCAN to the ones of sklearn.cluster.DBSCAN
+
+
+import os
+import sys
+
+import numpy as np
+import pytest
+import sklearn.cluster
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from grid_dbscan import GridDBSCAN
+
+
+# This function checks that GridDBSCAN and sklearn DBSCAN give the same clustering
+def assert_same_clustering(X, eps, min_samples, sample_weight=None, chunk_size=2**20):
+    expected = sklearn.cluster.DBSCAN(eps=eps, min_samples=min_samples).fit(X, sample_weight=sample_weight)
+    result = GridDBSCAN(eps=eps, min_samples=min_samples, chunk_size=chunk_size).fit(X, sample_weight=sample_weight)
+    np.testing.assert_array_equal(result.labels_, expected.labels_)
+    np.testing.assert_array_equal(result.core_sample_indices_, expected.core_sample_indices_)
+    np.testing.assert_array_equal(result.components_, expected.components_)
+
+
+def get_data(kind, rng, n):
+    if kind == 'normal':
+        return rng.normal(size=(n, 2))
+    if kind == 'duplicates':
+        # Few distinct points, many of them repeated
+        return np.round(rng.normal(size=(n, 2))*3)/3
+    if kind == 'blobs':
+        return np.concatenate([rng.normal(center, 0.2, size=(n//3+1, 2)) for center in rng.uniform(-5, 5, size=3)])
+    if kind == 'wide':
+        return rng.uniform(-1e3, 1e3, size=(n, 2))
+    raise ValueError(kind)
+
+
+@pytest.mark.parametrize('kind', ['normal', 'duplicates', 'blobs', 'wide'])
+@pytest.mark.parametrize('eps', [0.05, 1/3, 0.5, 2.0, 50.0])
+@pytest.mark.parametrize('min_samples', [1, 2, 5, 11])
+def test_random_data(kind, eps, min_samples):
+    rng = np.random.default_rng(0)
+    assert_same_clustering(get_data(kind, rng, 300), eps, min_samples)
+
+
+@pytest.mark.parametrize('eps', [1.0, np.sqrt(2), 2.0, 0.5])
+@pytest.mark.parametrize('min_samples', [2, 3, 5, 9])
+def test_grid_aligned_data(eps, min_samples):
+    # Points on an integer lattice, so that many distances are exactly Epsilon and many points lie on cell borders
+    X = np.array([(i, j) for i in range(-6, 7) for j in range(-4, 5) if (i*j) % 5 != 1], dtype=float)
+    assert_same_clustering(X, eps, min_samples)
+    assert_same_clustering(X*(eps/np.sqrt(2)), eps, min_samples)
+
+
+@pytest.mark.parametrize('eps', [0.3, 1.0])
+@pytest.mark.parametrize('margin', [-1e-3, -1e-6, 1e-6, 1e-3])
+def test_distances_close_to_eps(eps, margin):
+    # Stacked points at the two ends of a cell diagonal, just closer or just farther than Epsilon
+    side = eps/np.sqrt(2)*(1+margin)
+    X = np.array([(0, 0)]*3 + [(side, side)]*3 + [(2*side, 0)]*2, dtype=float)
+    for min_samples in [3, 4, 6]:
+        assert_same_clustering(X, eps, min_samples)
+
+
+@pytest.mark.parametrize('kind', ['normal', 'duplicates', 'blobs'])
+@pytest.mark.parametrize('min_samples', [1, 4, 10])
+def test_weighted_data(kind, min_samples):
+    rng = np.random.default_rng(1)
+    X = get_data(kind, rng, 300)
+    assert_same_clustering(X, 0.3, min_samples, rng.integers(1, 5, size=len(X)).astype(float))
+
+
+@pytest.mark.parametrize('kind', ['normal', 'duplicates', 'blobs'])
+@pytest.mark.parametrize('min_samples', [1, 4, 10])
+def test_negative_weights(kind, min_samples):
+    # With negative weights, a dense cell does not make its points core points
+    rng = np.random.default_rng(2)
+    X = get_data(kind, rng, 300)
+    assert_same_clustering(X, 0.3, min_samples, rng.uniform(-0.5, 3, size=len(X)))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64])
+def test_small_chunks(chunk_size):
+    rng = np.random.default_rng(3)
+    X = get_data('blobs', rng, 300)
+    assert_same_clustering(X, 0.3, 5, chunk_size=chunk_size)
+    assert_same_clustering(X, 0.3, 5, rng.uniform(-0.5, 3, size=len(X)), chunk_size=chunk_size)
+
+
+def test_deduplicated_data():
+    # The unique points weighted by their counts are clustered as all the points
+    rng = np.random.default_rng(4)
+    X = get_data('duplicates', rng, 1000)
+    unique_X, inverse_indices, counts = np.unique(X, axis=0, return_inverse=True, return_counts=True)
+    labels = sklearn.cluster.DBSCAN(eps=0.3, min_samples=8).fit(X).labels_
+    unique_labels = GridDBSCAN(eps=0.3, min_samples=8).fit(unique_X, sample_weight=counts).labels_
+    # The cluster numbers can differ, the partition is the same
+    pairs = set(zip(labels, unique_labels[inverse_indices.reshape(-1)]))
+    assert len(pairs) == len(set(labels)) == len(set(unique_labels))
+    assert all((label == -1) == (unique_label == -1) for label, unique_label in pairs)
+
+
+@pytest.mark.parametrize('n', [0, 1, 2])
+def test_tiny_data(n):
+    X = np.random.default_rng(5).normal(size=(n, 2))
+    result = GridDBSCAN(eps=0.5, min_samples=1).fit(X)
+    assert len(result.labels_) == n
+    if n > 0:
+        assert_same_clustering(X, 0.5, 1)
+        assert_same_clustering(X, 0.5, 2)
+
+
+def test_fit_predict():
+    X = np.random.default_rng(6).normal(size=(100, 2))
+    np.testing.assert_array_equal(GridDBSCAN(eps=0.3).fit_predict(X), sklearn.cluster.DBSCAN(eps=0.3).fit_predict(X))
+
+
+# A tiny Epsilon over a wide range has more cells than 64 bits cell keys (or integers) can index
+@pytest.mark.parametrize('scale, eps', [(1e3, 1e-7), (1e3, 1e-13), (1e12, 1e-9)])
+@pytest.mark.parametrize('min_samples', [1, 2, 5])
+@pytest.mark.parametrize('wide_axes', [[0], [1], [0, 1]])
+def test_tiny_eps_over_wide_range(scale, eps, min_samples, wide_axes):
+    rng = np.random.default_rng(9)
+    centers = rng.normal(size=(40, 2))
+    centers[:, wide_axes] = rng.uniform(-scale, scale, size=(40, len(wide_axes)))
+    X = centers[rng.integers(40, size=400)]+rng.normal(scale=eps, size=(400, 2))*[[1, 0.5]]
+    assert_same_clustering(X, eps, min_samples)
+
+
+@pytest.mark.parametrize('value', [np.nan, np.inf, -np.inf])
+def test_non_finite_data(value):
+    X = np.random.default_rng(7).normal(size=(10, 2))
+    X[3, 1] = value
+    with pytest.raises(ValueError):
+        sklearn.cluster.DBSCAN(eps=0.5).fit(X)
+    with pytest.raises(ValueError):
+        GridDBSCAN(eps=0.5).fit(X)
+
+
+def test_non_finite_weights():
+    X = np.random.default_rng(8).normal(size=(10, 2))
+    sample_weight = np.ones(len(X))
+    sample_weight[2] = np.nan
+    with pytest.raises(ValueError):
+        GridDBSCAN(eps=0.5).fit(X, sample_weight=sample_weight)
+
+
+@pytest.mark.parametrize('X, eps', [
+    (np.zeros((5, 3)), 0.5),
+    (np.zeros(5), 0.5),
+    (np.zeros((5, 2)), 0),
+    (np.zeros((5, 2)), -1),
+])
+def test_invalid_parameters(X, eps):
+    with pytest.raises(ValueError):
+        GridDBSCAN(eps=eps).fit(X)
+
+
+def test_invalid_weights_length():
+    with pytest.raises(ValueError):
+        GridDBSCAN(eps=0.5).fit(np.zeros((5, 2)), sample_weight=np.ones(4))
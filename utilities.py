@@ -6,68 +6,104 @@ import configparser
 import re
 import ast
 import sys
+import copy
+import concurrent.futures
 import time
 import psutil
 import logging
+import numpy as np
+import pandas as pd
 
 def get_process_col_locations(header_line, list_col_names):
+    # A column starts at its name and ends where the next column name starts (the last one ends with the line)
+    col_starts = [match.start() for match in re.finditer(r'\S+', header_line)]
     col_locations = {}
     for idx, col_name in enumerate(list_col_names):
-        col_width = len(col_name)
-        col_locations[col_name] = {}
-
-        if idx == 0:
-            col_locations[col_name]['start_idx'] = 0
-        else:
-            col_locations[col_name]['start_idx'] = col_locations[list_col_names[idx-1]]['end_idx']
-
-        if idx+1 < len(list_col_names):
-            re_pattern = r"(?<={})(.*?)(?={})".format(col_name, list_col_names[idx+1])
-        else:
-            re_pattern = r"(?<={})(.*?)".format(col_name)
-        whitespaces = re.findall(re_pattern, header_line)
-        col_width += len(whitespaces[0])
-        col_locations[col_name]['end_idx'] = col_locations[col_name]['start_idx']+col_width
+        col_locations[col_name] = {
+            'start_idx': col_starts[idx],
+            'end_idx': col_starts[idx+1] if idx+1 < len(list_col_names) else None
+        }
     return col_locations
 
-def parse_process_file(process_file):
-    with open(process_file) as f:
-        processes_lines = f.readlines()
-
-    summary_line_pattern = r'^\D*:'
-    is_header_line = False
-    is_header_line_seen = False
-    process_data = []
-
-    for line in processes_lines:
-        process_dict = {}
-
-        is_summary_line = re.match(summary_line_pattern, line)
-        if is_summary_line:
-            is_header_line_seen = False
-
-        is_header_line = True if 'PID' in line and '%CPU' in line else False
-        if is_header_line:
-            header_line = line.strip()
-            list_col_names = header_line.split()
-            col_locations = get_process_col_locations(header_line, list_col_names)
-            is_header_line = False
-            is_header_line_seen = True
+# Parse the process lines of a single snapshot into a dataframe of strings (one vectorized slice by column)
+def parse_process_lines(process_lines, col_locations):
+    width = max(max(len(line) for line in process_lines), max(location['start_idx'] for location in col_locations.values())+1)
+    # Fixed width character matrix of the snapshot (one row by process line)
+    chars = np.array([line.ljust(width) for line in process_lines], dtype='U{}'.format(width)).view('U1').reshape(len(process_lines), width)
+    columns = {}
+    for col_name, location in col_locations.items():
+        col_start_idx = location['start_idx']
+        col_end_idx = location['end_idx'] if location['end_idx'] is not None else width
+        values = np.ascontiguousarray(chars[:, col_start_idx:col_end_idx]).view('U{}'.format(col_end_idx-col_start_idx)).ravel()
+        columns[col_name] = np.char.strip(values).astype(object)
+    return pd.DataFrame(columns)
+
+# Set the type of the process columns: a column is numerical only if all its values are numbers
+def set_process_column_types(process_data):
+    for col_name in process_data.columns:
+        if pd.api.types.is_numeric_dtype(process_data[col_name]):
             continue
-
-        if is_header_line_seen:
-            for col_name in col_locations:
-                col_start_idx = col_locations[col_name]['start_idx']
-                col_end_idx = col_locations[col_name]['end_idx']
-                process_value = line[col_start_idx:col_end_idx].strip()
-                try:
-                    process_dict[col_name] = float(process_value)
-                except:
-                    process_dict[col_name] = process_value
-
-            process_data.append(process_dict)
+        try:
+            process_data[col_name] = process_data[col_name].astype(float)
+        except ValueError:
+            pass
     return process_data
 
+# Parse a file containing one or many concatenated snapshots of the top command output
+# The file is streamed, consecutive snapshots sharing the same columns are parsed at once by chunks of chunk_lines lines.
+# The SNAPSHOT column gives the snapshot number of each process line. The columns are typed once all the chunks are
+# parsed, so the types do not depend on the chunk boundaries.
+def parse_process_file(process_file, chunk_lines=100000):
+    summary_line_pattern = re.compile(r'^\D*:')
+    col_locations = None
+    snapshot = -1
+    process_lines = []
+    process_snapshots = []
+    chunks = []
+
+    def add_chunk():
+        if len(process_lines) > 0:
+            chunk = parse_process_lines(process_lines, chunk_col_locations)
+            chunk['SNAPSHOT'] = process_snapshots
+            chunks.append(chunk)
+        process_lines.clear()
+        process_snapshots.clear()
+
+    chunk_col_locations = None
+    with open(process_file) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if summary_line_pattern.match(line):
+                col_locations = None
+            elif 'PID' in line and '%CPU' in line:
+                col_locations = get_process_col_locations(line, line.split())
+                snapshot += 1
+                if col_locations != chunk_col_locations:
+                    add_chunk()
+                    chunk_col_locations = col_locations
+            elif col_locations is not None and line.strip() != '':
+                process_lines.append(line)
+                process_snapshots.append(snapshot)
+                if len(process_lines) >= chunk_lines:
+                    add_chunk()
+        add_chunk()
+
+    if len(chunks) == 0:
+        return pd.DataFrame()
+    return set_process_column_types(pd.concat(chunks, ignore_index=True))
+
+# Compute per PID aggregates over all the snapshots of a process file
+# The last snapshot values are kept and the mean/max of the time series columns are added
+def aggregate_process_snapshots(process_data, time_series_columns=('%CPU', 'POWER', 'CYCLES')):
+    grouped_data = process_data.groupby('PID', sort=False)
+    aggregated_data = grouped_data.last()
+    for col_name in time_series_columns:
+        if col_name in process_data.columns:
+            aggregated_data['{}_mean'.format(col_name)] = grouped_data[col_name].mean()
+            aggregated_data['{}_max'.format(col_name)] = grouped_data[col_name].max()
+    aggregated_data['SNAPSHOTS'] = grouped_data.size()
+    return aggregated_data
+
 def encode_single_line(single_line,features):
     return ",".join((str(single_line[feature]) for feature in features))
 
@@ -118,15 +154,16 @@ def encode_log_line(log_line,log_type,indices,categorical_fractions,encoding_typ
         log_line_data['special_chars'] = special_chars
         log_line_data['url_depth'] = float(url_depth)
 
+        # Values that are not in the indices/fractions (lines scored with a previously fitted vocabulary) are encoded as 0
         if encoding_type == 'label_encoding':
-            log_line_data['ip'] = indices['ips'].index(ip)+1
-            log_line_data['http_query'] = 100*(indices['http_queries'].index(http_query)+1)
-            log_line_data['user_agent'] = indices['user_agents'].index(user_agent)+1
+            log_line_data['ip'] = indices['ips'].index(ip)+1 if ip in indices['ips'] else 0
+            log_line_data['http_query'] = 100*(indices['http_queries'].index(http_query)+1) if http_query in indices['http_queries'] else 0
+            log_line_data['user_agent'] = indices['user_agents'].index(user_agent)+1 if user_agent in indices['user_agents'] else 0
 
         if encoding_type == 'fraction_encoding':
-            log_line_data['http_query']=categorical_fractions['http_queries'][http_query]
-            log_line_data['user_agent']=categorical_fractions['user_agents'][user_agent]
-            log_line_data['ip']=categorical_fractions['ips'][ip]
+            log_line_data['http_query']=categorical_fractions['http_queries'].get(http_query, 0)
+            log_line_data['user_agent']=categorical_fractions['user_agents'].get(user_agent, 0)
+            log_line_data['ip']=categorical_fractions['ips'].get(ip, 0)
 
     else:
         log_line_data = None
@@ -134,24 +171,111 @@ def encode_log_line(log_line,log_type,indices,categorical_fractions,encoding_typ
 
 # Encode all the data in http log file (access_log)
 def encode_log_file(log_file,log_type,encoding_type):
-    data = {}
     try:
         log_file_content = open(log_file, 'r')
     except:
         logging.info('Something went wrong reading the input file.')
         sys.exit(1)
-    log_file_content=list(log_file_content)
-    indices = get_categorical_indices(log_file_content,log_type)
-    categorical_fractions = get_categorical_fractions(log_file_content,log_type)
+    return encode_log_lines(list(log_file_content),log_type,encoding_type)
+
+# Encode a list of http log lines
+# The categorical indices and fractions are computed from the lines unless they are given
+def encode_log_lines(log_file_content,log_type,encoding_type,indices=None,categorical_fractions=None):
+    data = []
+    if indices is None:
+        indices = get_categorical_indices(log_file_content,log_type)
+    if categorical_fractions is None:
+        categorical_fractions = get_categorical_fractions(log_file_content,log_type)
     for log_line in log_file_content:
         log_line=log_line.replace(',','#').replace(';','#')
         _,log_line_data = encode_log_line(log_line,log_type,indices,categorical_fractions,encoding_type)
         if log_line_data is not None:
-            #data[url] = log_line_data
-            data[log_line] = log_line_data
+            # Identical log lines are all kept (they are collapsed later if deduplication is requested)
+            data.append((log_line, log_line_data))
     return data
 
 
+# Parse http log lines into a dataframe (one row by line with a positive return code)
+def parse_log_lines(log_file_content,log_type):
+    try:
+        log_format = re.compile(config['LOG'][log_type])
+    except:
+        print('Log type \'{}\' not defined. \nMake sure "settings.conf" file exits and the log concerned type is defined.\nExiting'.format(log_type))
+        sys.exit(1)
+    parsed_log_lines = []
+    for log_line in log_file_content:
+        try:
+            log_line_groups = log_format.match(log_line.replace(',','#').replace(';','#')).groups()
+        except:
+            print('Log type \'{}\' doesn\'t fit your log fomat.\nExiting'.format(log_type))
+            sys.exit(1)
+        parsed_log_lines.append((log_line_groups[0], log_line_groups[1], log_line_groups[2], int(log_line_groups[3]), log_line_groups[6], log_line))
+    parsed_logs = pd.DataFrame(parsed_log_lines, columns=['ip', 'timestamp', 'request', 'return_code', 'user_agent', 'log_line'])
+    parsed_logs = parsed_logs[parsed_logs['return_code'] > 0].reset_index(drop=True)
+    # Same http query and URL as encode_log_line
+    request = parsed_logs['request'].str.split(' ', n=1)
+    parsed_logs['http_query'] = request.str[0]
+    parsed_logs['url'] = request.str[1].fillna('').str.replace(' ', '', regex=False)
+    parsed_logs['timestamp'] = pd.to_datetime(parsed_logs['timestamp'], format='%d/%b/%Y:%H:%M:%S %z', utc=True)
+    return parsed_logs
+
+# Split http log lines into time windows (e.g. 1h, 1d) using the timestamp of each line
+# Only the lines that are encoded (positive return code) are kept, the line numbers are their index among these lines
+def split_log_lines_by_window(log_file_content,log_type,window):
+    parsed_logs = parse_log_lines(log_file_content,log_type)
+    window_duration = pd.to_timedelta(window)
+    windows = []
+    for window_start, window_logs in parsed_logs.groupby(parsed_logs['timestamp'].dt.floor(window_duration)):
+        windows.append({
+            'window_start': window_start,
+            'window_end': window_start+window_duration,
+            'line_numbers': window_logs.index.to_list(),
+            'log_lines': window_logs['log_line'].to_list(),
+        })
+    return windows
+
+# Aggregate parsed http log lines into client sessions (by IP, or by IP and user agent)
+def get_client_sessions(parsed_logs,by_user_agent=False):
+    client_keys = ['ip', 'user_agent'] if by_user_agent else ['ip']
+    url = parsed_logs['url']
+    log_lines = pd.DataFrame({
+        'ip': parsed_logs['ip'],
+        'user_agent': parsed_logs['user_agent'],
+        'timestamp': parsed_logs['timestamp'],
+        'url': url,
+        'error': (parsed_logs['return_code'] >= 400).astype(float),
+        'special_chars': url.str.count('[{}]'.format(re.escape(''.join(sorted(SPECIAL_CHARS))))),
+        'length': url.str.len(),
+        'get': (parsed_logs['http_query'] == 'GET').astype(float),
+        'post': (parsed_logs['http_query'] == 'POST').astype(float),
+        'head': (parsed_logs['http_query'] == 'HEAD').astype(float),
+        'log_line': parsed_logs['log_line'],
+    })
+    sessions = log_lines.groupby(client_keys, sort=False).agg(
+        requests=('url', 'size'),
+        first_request=('timestamp', 'min'),
+        last_request=('timestamp', 'max'),
+        distinct_urls=('url', 'nunique'),
+        error_ratio=('error', 'mean'),
+        mean_special_chars=('special_chars', 'mean'),
+        mean_length=('length', 'mean'),
+        get_ratio=('get', 'mean'),
+        post_ratio=('post', 'mean'),
+        head_ratio=('head', 'mean'),
+        log_lines=('log_line', list),
+    ).reset_index()
+    sessions['requests'] = sessions['requests'].astype(float)
+    sessions['distinct_urls'] = sessions['distinct_urls'].astype(float)
+    # Requests by second over the session duration (at least one second)
+    session_duration = (sessions['last_request']-sessions['first_request']).dt.total_seconds()
+    sessions['request_rate'] = sessions['requests']/np.maximum(session_duration, 1.)
+    sessions['other_method_ratio'] = 1.-sessions['get_ratio']-sessions['post_ratio']-sessions['head_ratio']
+    # Description of the client used as log line of the findings
+    sessions['log_line'] = (sessions[client_keys].agg(' '.join, axis=1) + ' - '
+        + sessions['requests'].astype(int).astype(str) + ' requests from '
+        + sessions['first_request'].astype(str) + ' to ' + sessions['last_request'].astype(str))
+    return sessions
+
 def get_categorical_indices(log_file_content,log_type):
     incides = {
         'http_queries':[],
@@ -230,7 +354,7 @@ def get_categorical_fractions(log_file_content,log_type):
 
 def construct_enconded_data_file(data,set_simulation_label):
 	labelled_data_str = f"{config['FEATURES']['features']},label,log_line\n"
-	for url in data:
+	for url, log_line_data in data:
 		# U for unknown
 		attack_label = 'U'
 		if set_simulation_label==True:
@@ -239,13 +363,27 @@ def construct_enconded_data_file(data,set_simulation_label):
 			patterns = ('honeypot', '%3b', 'xss', 'sql', 'union', '%3c', '%3e', 'eval')
 			if any(pattern in url.lower() for pattern in patterns):
 				attack_label = '1'
-		labelled_data_str += f"{encode_single_line(data[url],FEATURES)},{attack_label},{url}"
+		labelled_data_str += f"{encode_single_line(log_line_data,FEATURES)},{attack_label},{url}"
 	return len(data),labelled_data_str
 
 
 
 
-def gen_report(findings,log_file,log_type):
+# Maximum number of contributing log lines printed (terminal and report) by client finding
+MAX_PRINTED_CLIENT_LOG_LINES = 10
+
+# Log line cell of a HTTP finding in the report
+def get_report_log_line(finding):
+    report_log_line = finding['log_line']
+    if 'window_start' in finding:
+        report_log_line = '<i>Window: {} - {}</i><br>{}'.format(finding['window_start'],finding['window_end'],report_log_line)
+    if 'log_lines' in finding:
+        report_log_line += '<br>' + '<br>'.join(log_line.rstrip('\n') for log_line in finding['log_lines'][:MAX_PRINTED_CLIENT_LOG_LINES])
+        if len(finding['log_lines']) > MAX_PRINTED_CLIENT_LOG_LINES:
+            report_log_line += '<br><i>... {} more log lines</i>'.format(len(finding['log_lines'])-MAX_PRINTED_CLIENT_LOG_LINES)
+    return report_log_line
+
+def gen_report(findings,log_file,log_type,plot=True):
     report_file_path='./SCANS/scan_result_{}.html'.format(log_file.split('/')[-1].replace('.','_'))
     gmt_time=time.strftime("%d/%m/%y at %H:%M:%S GMT", time.gmtime())
     report_str="""
@@ -290,7 +428,7 @@ def gen_report(findings,log_file,log_type):
                             <h3>Findings: {}</h3>
                         </td>
                         <td>
-                            <img src='{}'/>
+                            {}
                         </td>
                 </tr>
                 </table>
@@ -302,7 +440,7 @@ def gen_report(findings,log_file,log_type):
                     <td style="width:83%">Log line</td>
                 </tr>
 
-        """.format(gmt_time,log_file,log_type,len(findings),report_file_path.replace('result','plot').replace('html','png').replace('./SCANS','.'),'Line#')
+        """.format(gmt_time,log_file,log_type,len(findings),"<img src='{}'/>".format(report_file_path.replace('result','plot').replace('html','png').replace('./SCANS','.')) if plot else '','Client#' if any('log_lines' in finding for finding in findings) else 'Line#')
     else:
         report_str+="""
             <div>
@@ -353,7 +491,8 @@ def gen_report(findings,log_file,log_type):
                     <td>{}</td>
                     <td>{}</td>
                 </tr>
-            """.format(background,severity.capitalize(),cves,finding['log_line_number']+1,finding['log_line'])
+            """.format(background,severity.capitalize(),cves,finding['log_line_number']+1,
+                       get_report_log_line(finding))
         else:
             report_str+="""
                 <tr>
@@ -369,14 +508,119 @@ def gen_report(findings,log_file,log_type):
     with open(report_file_path,'w') as result_file:
         result_file.write(report_str)
 
+# Process attributes that are slow to collect (they are collected concurrently)
+SLOW_PROCESS_ATTRIBUTES = {'open_files', 'connections', 'net_connections', 'memory_full_info', 'memory_maps', 'environ', 'threads'}
+
+# Recently collected process details by (pid, create_time)
+PROCESS_DETAILS_CACHE = {}
+
+# Get the details of many processes in a single sweep of the process table
+def get_processes_details(pids, max_workers=None, cache_ttl=None):
+    max_workers = max_workers if max_workers is not None else config.getint('PROCESS_DETAILS', 'workers', fallback=8)
+    cache_ttl = cache_ttl if cache_ttl is not None else config.getfloat('PROCESS_DETAILS', 'cache_ttl', fallback=10)
+    fast_attributes = [attribute for attribute in PROCESS_DETAILS_ATTRIBUTES if attribute not in SLOW_PROCESS_ATTRIBUTES]
+    slow_attributes = [attribute for attribute in PROCESS_DETAILS_ATTRIBUTES if attribute in SLOW_PROCESS_ATTRIBUTES]
+    pids = set(int(pid) for pid in pids)
+    now = time.monotonic()
+    processes_details = {}
+    uncached_processes = []
+    for process in psutil.process_iter():
+        if process.pid not in pids:
+            continue
+        try:
+            with process.oneshot():
+                cache_key = (process.pid, process.create_time())
+                if cache_key in PROCESS_DETAILS_CACHE and now-PROCESS_DETAILS_CACHE[cache_key][0] <= cache_ttl:
+                    processes_details[process.pid] = copy.deepcopy(PROCESS_DETAILS_CACHE[cache_key][1])
+                    continue
+                processes_details[process.pid] = process.as_dict(attrs=fast_attributes)
+        except psutil.Error as e:
+            print(f'Cannot get process details about PID: {process.pid} becasue {e}')
+            continue
+        uncached_processes.append((cache_key, process))
+
+    def get_slow_details(process):
+        try:
+            return process.as_dict(attrs=slow_attributes)
+        except psutil.Error as e:
+            print(f'Cannot get process details about PID: {process.pid} becasue {e}')
+            return {}
+
+    if len(slow_attributes) > 0 and len(uncached_processes) > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            slow_details = executor.map(get_slow_details, [process for _, process in uncached_processes])
+            for (_, process), details in zip(uncached_processes, slow_details):
+                processes_details[process.pid].update(details)
+    for cache_key, process in uncached_processes:
+        PROCESS_DETAILS_CACHE[cache_key] = (now, copy.deepcopy(processes_details[process.pid]))
+    for pid in pids - processes_details.keys():
+        print(f'Cannot get process details about PID: {pid} becasue it is not running anymore')
+        processes_details[pid] = {}
+    return processes_details
+
 def get_process_details(pid):
-    process_details_attributes = ast.literal_eval(config['PROCESS_DETAILS']['attributes'])
+    return get_processes_details([pid])[int(pid)]
+
+# Keep the process attributes supported by the installed psutil (the others would make as_dict raise a ValueError)
+def get_valid_process_attributes(attributes):
+    valid_attributes = []
+    for attribute in attributes:
+        try:
+            psutil.Process().as_dict(attrs=[attribute])
+            valid_attributes.append(attribute)
+        except ValueError:
+            print('The process attribute \'{}\' is not supported by psutil {} and is ignored.'.format(attribute, psutil.__version__))
+        except psutil.Error:
+            valid_attributes.append(attribute)
+    return valid_attributes
+
+# Collect the process table of the host (same format as a parsed top file with one snapshot)
+def collect_process_table(interval=1.0):
+    processes = list(psutil.process_iter())
+    # The CPU usage is measured between two calls of cpu_percent
+    for process in processes:
+        try:
+            process.cpu_percent(None)
+        except psutil.Error:
+            pass
+    time.sleep(interval)
+    process_data = []
+    for process in processes:
+        try:
+            with process.oneshot():
+                memory_info = process.memory_info()
+                ctx_switches = process.num_ctx_switches()
+                process_data.append({
+                    'PID': float(process.pid),
+                    'COMMAND': process.name(),
+                    '%CPU': process.cpu_percent(None),
+                    '%MEM': process.memory_percent(),
+                    '#TH': float(process.num_threads()),
+                    'RSS': float(memory_info.rss),
+                    'VSIZE': float(memory_info.vms),
+                    'CSW': float(ctx_switches.voluntary+ctx_switches.involuntary),
+                    'PPID': float(process.ppid()),
+                    'STATE': process.status(),
+                })
+        except psutil.Error:
+            continue
+    process_data = pd.DataFrame(process_data)
+    process_data['SNAPSHOT'] = 0
+    return process_data
+
+
+# Get the number of parallel jobs of the estimators and the number of BLAS/OpenMP threads
+# The command line values override the PARALLELISM settings, None keeps the libraries defaults
+def get_parallelism_settings(jobs=None, blas_threads=None):
+    jobs = jobs if jobs is not None else config.get('PARALLELISM', 'jobs', fallback=None)
+    blas_threads = blas_threads if blas_threads is not None else config.get('PARALLELISM', 'blas_threads', fallback=None)
     try:
-        process = psutil.Process(pid)
-        return process.as_dict(attrs=process_details_attributes)
-    except Exception as e:
-        print(f'Cannot get process details about PID: {pid} becasue {e}')
-        return {}
+        jobs = int(jobs) if jobs not in [None, ''] else None
+        blas_threads = int(blas_threads) if blas_threads not in [None, ''] else None
+    except:
+        logging.info('The number of parallel jobs and of BLAS threads should be integers.')
+        sys.exit(1)
+    return jobs, blas_threads
 
 config = configparser.ConfigParser()
 config.sections()
@@ -390,3 +634,9 @@ except:
     print('No features defined. Make sure the file "settings.conf" exists and training/prediction features are defined.')
     print('Exiting..')
     sys.exit(1)
+
+try:
+    PROCESS_DETAILS_ATTRIBUTES = ast.literal_eval(config['PROCESS_DETAILS']['attributes'])
+except:
+    PROCESS_DETAILS_ATTRIBUTES = []
+PROCESS_DETAILS_ATTRIBUTES = get_valid_process_attributes(PROCESS_DETAILS_ATTRIBUTES)